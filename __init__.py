@@ -1,229 +1,787 @@
 from aqt.qt import *
 from aqt.editor import Editor
+from aqt.reviewer import Reviewer
 from aqt import gui_hooks, mw
-from aqt.utils import showInfo
-import re
+from aqt.utils import showInfo, tooltip
+from aqt.operations import CollectionOp, QueryOp
 import os
-import shutil
+import re
+import json
+import math
 import time
-import random
+from collections import OrderedDict
+from functools import partial
+from .media_store import record_output, store_original
+from .render import generate_html
+from .imaging import read_image_size, decode_image
+from .encoding import encoding_settings, needs_reencode, reencode
+from .batch import add_notes_batched, report_progress, save_template, setup_browser_action
+from .note_images import card_fields, find_note_images, replace_images
+from .occlusion_data import DATA_ATTRIBUTE, build_model, mask_ids, pixel_rects, read_model, same_content
+from .occlusion_io import setup_transfer_actions
+from .media_gc import setup_gc_action
+from .rect_store import RectStore
+from .commands import UndoStack, AddRect, RemoveRects, MoveRects, SetRect, Relabel, CommandGroup
+from . import detect
+from . import tracing
+from .phash_index import remember_layout, similar_layouts
+from .assets import REVIEWER_JS, READY_JS, ensure_media_assets, setup_migration_action
+
+TILE_SIZE = 512
+TILE_CACHE_VIEWPORTS = 3
+MIN_ZOOM = 0.02
+MAX_ZOOM = 8.0
+HANDLE_SIZE = 8
+
+def build_levels(image):
+    levels = [image]
+    while levels[-1].width() > TILE_SIZE or levels[-1].height() > TILE_SIZE:
+        previous = levels[-1]
+        with tracing.span("image.scale", level=len(levels)):
+            levels.append(previous.scaled(
+                max(1, previous.width() // 2),
+                max(1, previous.height() // 2),
+                Qt.AspectRatioMode.IgnoreAspectRatio,
+                Qt.TransformationMode.SmoothTransformation
+            ))
+    return levels
+
+def pixmap_bytes(pixmap):
+    return pixmap.width() * pixmap.height() * pixmap.depth() // 8
+
+def tile_cache_budget(viewport):
+    cols = math.ceil(viewport.width() / TILE_SIZE) + 1
+    rows = math.ceil(viewport.height() / TILE_SIZE) + 1
+    return TILE_CACHE_VIEWPORTS * cols * rows * TILE_SIZE * TILE_SIZE * 4
+
+class ImagePyramid:
+    def __init__(self, levels):
+        self.levels = levels
+        self.tiles = OrderedDict()
+        self.tile_bytes = 0
+
+    def size(self):
+        return self.levels[0].size()
+
+    def level_for_zoom(self, zoom, base_scale=1.0):
+        level = 0
+        while level + 1 < len(self.levels) and zoom <= base_scale * 0.5 ** (level + 1):
+            level += 1
+        return level
+
+    def tile(self, level, col, row, budget):
+        key = (level, col, row)
+        pixmap = self.tiles.get(key)
+        if pixmap is not None:
+            self.tiles.move_to_end(key)
+            return pixmap
+        image = self.levels[level]
+        source = QRect(col * TILE_SIZE, row * TILE_SIZE, TILE_SIZE, TILE_SIZE).intersected(image.rect())
+        pixmap = QPixmap.fromImage(image.copy(source))
+        self.tiles[key] = pixmap
+        self.tile_bytes += pixmap_bytes(pixmap)
+        while self.tile_bytes > budget and len(self.tiles) > 1:
+            self.tile_bytes -= pixmap_bytes(self.tiles.popitem(last=False)[1])
+        return pixmap
+
+PREVIEW_SIZE = QSize(1024, 1024)
+HASH_DECODE_SIZE = QSize(256, 256)
+THUMBNAIL_CACHE_BYTES = 48 * 1024 * 1024
+thumbnail_cache = OrderedDict()
+
+def thumbnail_key(full_path):
+    try:
+        return (os.path.basename(full_path), os.stat(full_path).st_mtime_ns)
+    except OSError:
+        return None
+
+def cached_thumbnail(key):
+    image = thumbnail_cache.get(key)
+    if image is not None:
+        thumbnail_cache.move_to_end(key)
+    return image
+
+def store_thumbnail(key, image):
+    if key is None or image.isNull():
+        return
+    thumbnail_cache[key] = image
+    thumbnail_cache.move_to_end(key)
+    while len(thumbnail_cache) > 1 and sum(cached.sizeInBytes() for cached in thumbnail_cache.values()) > THUMBNAIL_CACHE_BYTES:
+        thumbnail_cache.popitem(last=False)
+
+class ImageLoadSignals(QObject):
+    loaded = pyqtSignal(str, object, bool)
+
+class ImageLoadTask(QRunnable):
+    def __init__(self, full_path, max_size=None):
+        super().__init__()
+        self.full_path = full_path
+        self.max_size = max_size
+        self.signals = ImageLoadSignals()
+
+    def run(self):
+        image = decode_image(self.full_path, self.max_size)
+        levels = [image] if image.isNull() else build_levels(image)
+        self.signals.loaded.emit(self.full_path, levels, self.max_size is None)
 
-class DrawingArea(QLabel):
-    def __init__(self, pixmap, parent=None):
+class TaskSignals(QObject):
+    finished = pyqtSignal(object)
+
+class ResultTask(QRunnable):
+    def __init__(self, func, *args):
+        super().__init__()
+        self.func = func
+        self.args = args
+        self.signals = TaskSignals()
+
+    def run(self):
+        try:
+            result = self.func(*self.args)
+        except Exception as e:
+            result = e
+        self.signals.finished.emit(result)
+
+def run_with_result(callback, func, *args):
+    task = ResultTask(func, *args)
+    task.signals.finished.connect(callback)
+    QThreadPool.globalInstance().start(task)
+    return task
+
+def notify(message, period=3000):
+    if mw is not None:
+        tooltip(message, period=period)
+
+def report_background_error(func, error):
+    if tracing.enabled():
+        tracing.record("background.error", tracing.now_us(), 0, args={"task": func.__name__, "error": str(error)})
+    notify(f"Oclusão: falha em {func.__name__}: {error}")
+
+def run_in_background(func, *args, on_error=None):
+    def finished(result):
+        if isinstance(result, Exception):
+            (on_error or partial(report_background_error, func))(result)
+    return run_with_result(finished, func, *args)
+
+def load_image_async(full_path, callback, max_size=None):
+    task = ImageLoadTask(full_path, max_size)
+    task.signals.loaded.connect(callback)
+    QThreadPool.globalInstance().start(task)
+    return task
+
+def lookup_similar_layouts(img_filename, full_path):
+    return similar_layouts(img_filename, decode_image(full_path, HASH_DECODE_SIZE))
+
+def detect_image_regions(image):
+    return detect.detect_text_regions(detect.gray_array(image))
+
+class DrawingArea(QWidget):
+    def __init__(self, image, parent=None, original_size=None):
         super().__init__(parent)
-        self.setPixmap(pixmap)
-        self.original_pixmap = pixmap.copy()
+        if isinstance(image, QPixmap):
+            image = image.toImage()
+        self.pyramid = ImagePyramid(build_levels(image))
+        self.edited_pixmap = image
+        self.full_resolution = original_size is None or image.size() == original_size
+        self.active = True
+        self.cache_key = None
         self.rectangle_mode = False
         self.start_point = QPoint()
         self.current_rect = None
-        self.rectangles = []
-        self.texts = []
+        self.store = RectStore()
+        self.history = UndoStack()
+        self.drag_session = 0
+        self.selection = set()
+        self.drag_mode = None
+        self.drag_last = None
+        self.drag_handle = None
+        self.band_start = None
+        self.band_rect = None
+        self.band_base = set()
+        self.candidates = []
+        self.candidate_pen = QPen(QColor(0, 160, 0), 2, Qt.PenStyle.DashLine)
         self.text_position = "top"
-        self.edited_pixmap = pixmap.copy()
+        self.mask_style = "div"
+        self.card_option = "single"
+        self.stored_model = None
+        self.distractors = []
         self.scale_factor = 1.0
-        self.original_size = pixmap.size()
+        self.original_size = original_size or image.size()
         self.timestamp = str(int(time.time()))
+        self.fill_color = QColor(255, 255, 0, 255)
+        self.border_pen = QPen(Qt.GlobalColor.black, 2)
+        self.selection_pen = QPen(QColor(0, 120, 215), 2, Qt.PenStyle.DashLine)
+        self.zoom = 1.0
+        self.offset = QPointF(0, 0)
+        self.pan_origin = None
+        self.fitted = False
+        self.setMinimumSize(600, 400)
+        self.setSizePolicy(QSizePolicy.Policy.Expanding, QSizePolicy.Policy.Expanding)
         self.setMouseTracking(True)
+        self.setFocusPolicy(Qt.FocusPolicy.StrongFocus)
+
+    @property
+    def rectangles(self):
+        return [QRect(*rect) for rect in self.store]
+
+    @property
+    def texts(self):
+        return self.store.texts + self.distractors
+
+    def rect_at(self, index):
+        return QRect(*self.store.rect(index))
+
+    def sizeHint(self):
+        return QSize(900, 600)
+
+    def show_preview(self, full_path, levels, full_resolution):
+        image = levels[0]
+        if not full_resolution:
+            store_thumbnail(self.cache_key, image)
+        if image.isNull() or self.full_resolution or (full_resolution and not self.active):
+            return
+        self.pyramid = ImagePyramid(levels)
+        self.edited_pixmap = image
+        self.full_resolution = full_resolution
+        self.update()
+
+    def release_image(self):
+        self.active = False
+        if not self.full_resolution:
+            self.pyramid.tiles.clear()
+            self.pyramid.tile_bytes = 0
+            return
+        preview = cached_thumbnail(self.cache_key)
+        if preview is None:
+            preview = placeholder_image()
+        self.pyramid = ImagePyramid(build_levels(preview))
+        self.edited_pixmap = preview
+        self.full_resolution = False
+
+    def fit_to_window(self):
+        size = self.original_size
+        if size.width() <= 0 or size.height() <= 0:
+            return
+        self.zoom = min(self.width() / size.width(), self.height() / size.height(), 1.0)
+        self.offset = QPointF(
+            (self.width() - size.width() * self.zoom) / 2,
+            (self.height() - size.height() * self.zoom) / 2
+        )
+        self.fitted = True
+        self.update()
+
+    def resizeEvent(self, event):
+        super().resizeEvent(event)
+        if not self.fitted:
+            self.fit_to_window()
+
+    def view_to_image(self, pos):
+        x = (pos.x() - self.offset.x()) / self.zoom
+        y = (pos.y() - self.offset.y()) / self.zoom
+        x = min(max(x, 0), self.original_size.width() - 1)
+        y = min(max(y, 0), self.original_size.height() - 1)
+        return QPoint(int(round(x)), int(round(y)))
+
+    def image_to_view(self, rect):
+        return QRectF(
+            self.offset.x() + rect.x() * self.zoom,
+            self.offset.y() + rect.y() * self.zoom,
+            rect.width() * self.zoom,
+            rect.height() * self.zoom
+        )
+
+    def view_to_image_rect(self, rect):
+        left = math.floor((rect.left() - self.offset.x()) / self.zoom)
+        top = math.floor((rect.top() - self.offset.y()) / self.zoom)
+        right = math.ceil((rect.right() + 1 - self.offset.x()) / self.zoom)
+        bottom = math.ceil((rect.bottom() + 1 - self.offset.y()) / self.zoom)
+        return left, top, right - left, bottom - top
+
+    def rect_bounds(self, rect):
+        margin = self.border_pen.width() + HANDLE_SIZE
+        return self.image_to_view(rect).toAlignedRect().adjusted(-margin, -margin, margin, margin)
+
+    def handles(self, rect):
+        view_rect = self.image_to_view(rect)
+        half = HANDLE_SIZE / 2
+        corners = {
+            "tl": view_rect.topLeft(),
+            "tr": view_rect.topRight(),
+            "bl": view_rect.bottomLeft(),
+            "br": view_rect.bottomRight(),
+        }
+        return {name: QRectF(point.x() - half, point.y() - half, HANDLE_SIZE, HANDLE_SIZE) for name, point in corners.items()}
+
+    def handle_at(self, pos):
+        if len(self.selection) != 1:
+            return None
+        for name, handle in self.handles(self.rect_at(next(iter(self.selection)))).items():
+            if handle.contains(pos):
+                return name
+        return None
+
+    def set_selection(self, selection):
+        changed = self.selection.symmetric_difference(selection)
+        self.selection = set(selection)
+        self.invalidate(*[self.rect_at(index) for index in changed])
+
+    def delete_selected(self):
+        if not self.selection:
+            return
+        self.history.execute(RemoveRects(self.store, self.selection), self.store)
+        self.selection = set()
+        self.update()
+
+    def relabel(self, index):
+        old_text = self.store.texts[index]
+        text, ok = QInputDialog.getText(self, "Texto do Retângulo", "Digite o texto para este retângulo:", text=old_text)
+        if ok and text.strip() and text.strip() != old_text:
+            self.history.execute(Relabel(index, old_text, text.strip()), self.store)
+
+    def detect_labels(self):
+        if not detect.available():
+            showInfo("A detecção automática precisa do NumPy, que não está disponível nesta instalação do Anki.")
+            return
+        image = self.edited_pixmap
+        scale = self.original_size.width() / image.width()
+        self.setCursor(Qt.CursorShape.BusyCursor)
+        run_with_result(lambda regions: self.show_candidates(regions, scale), detect_image_regions, image)
+
+    def show_candidates(self, regions, scale):
+        self.unsetCursor()
+        if isinstance(regions, Exception):
+            showInfo(f"Erro na detecção automática: {regions}")
+            return
+        candidates = []
+        for x, y, w, h in regions:
+            rect = (round(x * scale), round(y * scale), max(2, round(w * scale)), max(2, round(h * scale)))
+            if not self.store.query(*rect):
+                candidates.append((rect, None))
+        self.candidates = candidates
+        self.update()
+        if not candidates:
+            notify("Nenhuma região de texto encontrada.")
+
+    def offer_layouts(self, matches):
+        if isinstance(matches, Exception) or not matches or len(self.store):
+            return
+        distance, entry = matches[0]
+        width, height = self.original_size.width(), self.original_size.height()
+        texts = entry["texts"]
+        self.candidates = [
+            (rect, texts[i] if i < len(texts) else None)
+            for i, rect in enumerate(pixel_rects(entry, width, height))
+        ]
+        self.update()
+        notify(f"Imagem semelhante encontrada ({entry['img']}): {len(self.candidates)} retângulos sugeridos. Aceite ou descarte as sugestões.", period=6000)
+
+    def candidate_at(self, point):
+        for i in range(len(self.candidates) - 1, -1, -1):
+            if QRect(*self.candidates[i][0]).contains(point):
+                return i
+        return None
+
+    def accept_candidates(self, indices=None):
+        if indices is None:
+            indices = range(len(self.candidates))
+        indices = set(indices)
+        accepted = [self.candidates[i] for i in sorted(indices)]
+        if not accepted:
+            return
+        first = len(self.store) + 1
+        commands = [AddRect(rect, label or f"Texto {first + i}") for i, (rect, label) in enumerate(accepted)]
+        self.history.execute(CommandGroup(commands), self.store)
+        self.candidates = [candidate for i, candidate in enumerate(self.candidates) if i not in indices]
+        self.update()
+
+    def reject_candidates(self, indices=None):
+        if indices is None:
+            self.candidates = []
+        else:
+            doomed = set(indices)
+            self.candidates = [candidate for i, candidate in enumerate(self.candidates) if i not in doomed]
+        self.update()
+
+    def undo(self):
+        command = self.history.undo(self.store)
+        if command is not None:
+            self.after_history(command)
+
+    def redo(self):
+        command = self.history.redo(self.store)
+        if command is not None:
+            self.after_history(command)
+
+    def after_history(self, command):
+        if isinstance(command, (AddRect, RemoveRects, CommandGroup)):
+            self.selection = set()
+        self.update()
+
+    def move_selection(self, dx, dy):
+        rects = [self.rect_at(index) for index in self.selection]
+        bounds = QRect()
+        for rect in rects:
+            bounds = bounds.united(rect)
+        dx = min(max(dx, -bounds.left()), self.original_size.width() - bounds.right() - 1)
+        dy = min(max(dy, -bounds.top()), self.original_size.height() - bounds.bottom() - 1)
+        if not dx and not dy:
+            return
+        self.history.execute(MoveRects(self.selection, dx, dy, self.drag_session), self.store)
+        self.invalidate(bounds, bounds.translated(dx, dy))
+
+    def resize_selection(self, point):
+        index = next(iter(self.selection))
+        old_rect = self.rect_at(index)
+        rect = QRect(old_rect)
+        if "l" in self.drag_handle:
+            rect.setLeft(min(point.x(), rect.right() - 1))
+        else:
+            rect.setRight(max(point.x(), rect.left() + 1))
+        if "t" in self.drag_handle:
+            rect.setTop(min(point.y(), rect.bottom() - 1))
+        else:
+            rect.setBottom(max(point.y(), rect.top() + 1))
+        old = (old_rect.x(), old_rect.y(), old_rect.width(), old_rect.height())
+        new = (rect.x(), rect.y(), rect.width(), rect.height())
+        self.history.execute(SetRect(index, old, new, self.drag_session), self.store)
+        self.invalidate(old_rect, rect)
+
+    def invalidate(self, *rects):
+        region = QRect()
+        for rect in rects:
+            if rect is not None:
+                region = region.united(self.rect_bounds(rect))
+        if not region.isNull():
+            self.update(region)
+
+    def zoom_at(self, pos, factor):
+        zoom = min(max(self.zoom * factor, MIN_ZOOM), MAX_ZOOM)
+        anchor_x = (pos.x() - self.offset.x()) / self.zoom
+        anchor_y = (pos.y() - self.offset.y()) / self.zoom
+        self.zoom = zoom
+        self.offset = QPointF(pos.x() - anchor_x * zoom, pos.y() - anchor_y * zoom)
+        self.update()
+
+    def wheelEvent(self, event):
+        steps = event.angleDelta().y() / 120
+        if steps:
+            self.zoom_at(event.position(), 1.25 ** steps)
 
     def mousePressEvent(self, event):
+        pos = event.position()
+        self.drag_session += 1
         if event.button() == Qt.MouseButton.LeftButton and self.rectangle_mode:
-            self.start_point = event.pos()
+            self.start_point = self.view_to_image(pos)
             self.current_rect = QRect(self.start_point, QSize(0, 0))
-            self.update_with_rectangles()
+            self.drag_mode = "draw"
+            self.invalidate(self.current_rect)
+        elif self.candidates and event.button() in (Qt.MouseButton.LeftButton, Qt.MouseButton.RightButton) \
+                and self.candidate_at(self.view_to_image(pos)) is not None:
+            index = self.candidate_at(self.view_to_image(pos))
+            if event.button() == Qt.MouseButton.LeftButton:
+                self.accept_candidates([index])
+            else:
+                self.reject_candidates([index])
+        elif event.button() == Qt.MouseButton.LeftButton:
+            point = self.view_to_image(pos)
+            additive = bool(event.modifiers() & Qt.KeyboardModifier.ShiftModifier)
+            self.drag_handle = self.handle_at(pos)
+            index = None if self.drag_handle else self.store.hit(point.x(), point.y())
+            if self.drag_handle:
+                self.drag_mode = "resize"
+            elif index is not None:
+                if additive:
+                    self.set_selection(self.selection ^ {index})
+                elif index not in self.selection:
+                    self.set_selection({index})
+                self.drag_mode = "move"
+                self.drag_last = point
+            else:
+                self.drag_mode = "band"
+                self.band_start = point
+                self.band_base = set(self.selection) if additive else set()
+                self.set_selection(self.band_base)
+        elif event.button() in (Qt.MouseButton.MiddleButton, Qt.MouseButton.RightButton):
+            self.drag_mode = "pan"
+            self.pan_origin = pos
+            self.setCursor(Qt.CursorShape.ClosedHandCursor)
 
     def mouseMoveEvent(self, event):
-        if event.buttons() & Qt.MouseButton.LeftButton and self.rectangle_mode:
-            self.current_rect = QRect(self.start_point, event.pos()).normalized()
-            self.update_with_rectangles()
+        pos = event.position()
+        if self.drag_mode == "pan":
+            delta = pos - self.pan_origin
+            self.pan_origin = pos
+            self.offset += delta
+            self.scroll(int(round(delta.x())), int(round(delta.y())))
+        elif self.drag_mode == "draw" and self.current_rect is not None:
+            old_rect = self.current_rect
+            self.current_rect = QRect(self.start_point, self.view_to_image(pos)).normalized()
+            self.invalidate(old_rect, self.current_rect)
+        elif self.drag_mode == "move" and self.selection:
+            point = self.view_to_image(pos)
+            self.move_selection(point.x() - self.drag_last.x(), point.y() - self.drag_last.y())
+            self.drag_last = point
+        elif self.drag_mode == "resize" and self.selection:
+            self.resize_selection(self.view_to_image(pos))
+        elif self.drag_mode == "band":
+            old_band = self.band_rect
+            self.band_rect = QRect(self.band_start, self.view_to_image(pos)).normalized()
+            self.invalidate(old_band, self.band_rect)
+            band = self.band_rect
+            self.set_selection(self.band_base | set(self.store.query(band.x(), band.y(), band.width(), band.height())))
+        elif self.drag_mode is None and not self.rectangle_mode:
+            handle = self.handle_at(pos)
+            if handle in ("tl", "br"):
+                self.setCursor(Qt.CursorShape.SizeFDiagCursor)
+            elif handle:
+                self.setCursor(Qt.CursorShape.SizeBDiagCursor)
+            else:
+                self.unsetCursor()
 
     def mouseReleaseEvent(self, event):
-        if event.button() == Qt.MouseButton.LeftButton and self.rectangle_mode and self.current_rect:
+        drag_mode, self.drag_mode = self.drag_mode, None
+        if drag_mode == "pan":
+            self.pan_origin = None
+            self.unsetCursor()
+            self.update()
+        elif drag_mode == "band":
+            old_band, self.band_rect = self.band_rect, None
+            self.invalidate(old_band)
+        elif drag_mode == "draw" and self.current_rect:
             self.current_rect = self.current_rect.normalized()
+            finished_rect = self.current_rect
             if self.current_rect.width() >= 2 and self.current_rect.height() >= 2:
-                self.rectangles.append(self.current_rect)
+                rect = self.current_rect
                 text, ok = QInputDialog.getText(self, "Texto do Retângulo", "Digite o texto para este retângulo:")
-                if ok and text.strip():
-                    self.texts.append(text.strip())
-                else:
-                    self.texts.append(f"Texto {len(self.rectangles)}")
+                label = text.strip() if ok and text.strip() else f"Texto {len(self.store) + 1}"
+                self.history.execute(AddRect((rect.x(), rect.y(), rect.width(), rect.height()), label), self.store)
             self.current_rect = None
-            self.update_with_rectangles()
+            self.invalidate(finished_rect)
+
+    def mouseDoubleClickEvent(self, event):
+        if self.rectangle_mode:
+            return
+        point = self.view_to_image(event.position())
+        index = self.store.hit(point.x(), point.y())
+        if index is not None:
+            self.relabel(index)
+
+    def keyPressEvent(self, event):
+        if event.key() in (Qt.Key.Key_Delete, Qt.Key.Key_Backspace):
+            self.delete_selected()
+        elif event.key() == Qt.Key.Key_A and event.modifiers() & Qt.KeyboardModifier.ControlModifier:
+            self.set_selection(set(range(len(self.store))))
+        elif event.key() == Qt.Key.Key_Escape and self.selection:
+            self.set_selection(set())
+        else:
+            super().keyPressEvent(event)
+
+    def load_model(self, model):
+        width, height = self.original_size.width(), self.original_size.height()
+        self.store.clear()
+        self.history = UndoStack()
+        self.selection = set()
+        texts = model["texts"]
+        rects = pixel_rects(model, width, height)
+        ids = mask_ids(model)
+        for i, rect in enumerate(rects):
+            self.store.add(*rect, texts[i] if i < len(texts) else f"Texto {i + 1}", ids[i])
+        self.distractors = list(texts[len(rects):]) if model["card_option"] == "multiple" else []
+        self.text_position = model["text_position"] if model["text_position"] in TEXT_POSITIONS else "top"
+        self.mask_style = model["mask_style"]
+        self.card_option = model["card_option"]
+        self.stored_model = model
+        self.update()
 
     def update_with_rectangles(self):
-        pixmap = self.edited_pixmap.copy()
-        painter = QPainter(pixmap)
-        yellow_solid = QColor(255, 255, 0, 255)
-        for rect in self.rectangles:
-            painter.fillRect(rect, yellow_solid)
-            painter.setPen(QPen(Qt.GlobalColor.black, 2))
-            painter.drawRect(rect)
+        self.update()
+
+    def paint_image(self, painter, dirty):
+        base_scale = self.pyramid.size().width() / self.original_size.width()
+        level = self.pyramid.level_for_zoom(self.zoom, base_scale)
+        image = self.pyramid.levels[level]
+        level_scale = image.width() / self.original_size.width()
+        view_scale = self.zoom / level_scale
+        left = (dirty.left() - self.offset.x()) / view_scale
+        top = (dirty.top() - self.offset.y()) / view_scale
+        right = (dirty.right() + 1 - self.offset.x()) / view_scale
+        bottom = (dirty.bottom() + 1 - self.offset.y()) / view_scale
+        first_col = max(0, int(left // TILE_SIZE))
+        first_row = max(0, int(top // TILE_SIZE))
+        last_col = min((image.width() - 1) // TILE_SIZE, int(right // TILE_SIZE))
+        last_row = min((image.height() - 1) // TILE_SIZE, int(bottom // TILE_SIZE))
+        budget = tile_cache_budget(self.size())
+        for row in range(first_row, last_row + 1):
+            for col in range(first_col, last_col + 1):
+                tile = self.pyramid.tile(level, col, row, budget)
+                target = QRectF(
+                    self.offset.x() + col * TILE_SIZE * view_scale,
+                    self.offset.y() + row * TILE_SIZE * view_scale,
+                    tile.width() * view_scale,
+                    tile.height() * view_scale
+                )
+                painter.drawPixmap(target, tile, QRectF(tile.rect()))
+
+    def paint_rect(self, painter, rect):
+        view_rect = self.image_to_view(rect)
+        painter.fillRect(view_rect, self.fill_color)
+        painter.drawRect(view_rect)
+
+    def paintEvent(self, event):
+        dirty = event.rect()
+        painter = QPainter(self)
+        painter.fillRect(dirty, self.palette().color(QPalette.ColorRole.Window))
+        painter.setRenderHint(QPainter.RenderHint.SmoothPixmapTransform, self.zoom < 1.0)
+        self.paint_image(painter, dirty)
+        painter.setPen(self.border_pen)
+        visible = self.store.query(*self.view_to_image_rect(dirty.adjusted(-HANDLE_SIZE, -HANDLE_SIZE, HANDLE_SIZE, HANDLE_SIZE)))
+        for index in visible:
+            self.paint_rect(painter, self.rect_at(index))
         if self.rectangle_mode and self.current_rect:
-            painter.fillRect(self.current_rect, yellow_solid)
-            painter.setPen(QPen(Qt.GlobalColor.black, 2))
-            painter.drawRect(self.current_rect)
+            self.paint_rect(painter, self.current_rect)
+        selected = [index for index in visible if index in self.selection]
+        if selected:
+            painter.setPen(self.selection_pen)
+            painter.setBrush(Qt.BrushStyle.NoBrush)
+            for index in selected:
+                painter.drawRect(self.image_to_view(self.rect_at(index)))
+            if len(self.selection) == 1:
+                for handle in self.handles(self.rect_at(selected[0])).values():
+                    painter.fillRect(handle, self.selection_pen.color())
+        if self.candidates:
+            painter.setPen(self.candidate_pen)
+            painter.setBrush(Qt.BrushStyle.NoBrush)
+            for rect, _ in self.candidates:
+                painter.drawRect(self.image_to_view(QRect(*rect)))
+        if self.band_rect is not None:
+            painter.setPen(self.selection_pen)
+            painter.setBrush(Qt.BrushStyle.NoBrush)
+            painter.drawRect(self.image_to_view(self.band_rect))
         painter.end()
-        self.setPixmap(pixmap)
-
-def generate_html(img_path, pixmap, rectangles, output_dir, scale_factor, timestamp, card_option="single", texts=None, text_position="top"):
-    img_filename = os.path.basename(img_path)
-    full_path = os.path.join(output_dir, img_filename)
-    if not os.path.exists(full_path):
-        raise FileNotFoundError(f"Image file not found: {full_path}")
-    orig_width = pixmap.width()
-    orig_height = pixmap.height()
-    texts = texts or []
-    
-    shuffled_texts = texts.copy()
-    random.shuffle(shuffled_texts)
-    
-    container_style = "position:relative;"
-    text_container_style = ""
-    if text_position == "top":
-        container_style += "display:flex; flex-direction:column; align-items:center;"
-        text_container_style = "display:flex; flex-wrap:wrap; gap:10px; margin-bottom:10px;"
-    elif text_position == "bottom":
-        container_style += "display:flex; flex-direction:column; align-items:center;"
-        text_container_style = "display:flex; flex-wrap:wrap; gap:10px; margin-top:10px;"
-    elif text_position == "left":
-        container_style += "display:flex; flex-direction:row; align-items:flex-start;"
-        text_container_style = "display:flex; flex-direction:column; gap:10px; margin-right:10px;"
-    elif text_position == "right":
-        container_style += "display:flex; flex-direction:row; align-items:flex-start;"
-        text_container_style = "display:flex; flex-direction:column; gap:10px; margin-left:10px;"
-    
-    css = """
-.anki-container { max-width:100%; min-height:100px; }
-.anki-text-container { background-color:#e0e0e0; padding:5px; border:1px solid #ccc; min-height:30px; }
-.anki-text-container.drop-target { background-color:#d0d0d0; border:1px dashed #000; }
-.anki-container.drop-target { background-color:rgba(200, 200, 200, 0.2); border:1px dashed #000; }
-.anki-text { padding:5px 10px; background-color:#f0f0f0; border:1px solid #000; cursor:move; user-select:none; z-index:20; position:static; }
-.anki-text.dragging { opacity:0.5; }
-.anki-text.correct { background-color:#00ff00; }
-.anki-text.incorrect { background-color:#ff0000; }
-.anki-text.free { position:absolute; }
-.anki-image-container { position:relative; display:inline-block; max-width:100%; }
-.anki-image-container img { max-width:100%; width:100%; display:block; }
-.anki-rect, .anki-rect-multi { position:absolute; background-color:yellow; border:2px solid black; cursor:pointer; display:block; }
-.anki-rect:hover, .anki-rect-multi:hover { display:none; }
-.anki-rect.drop-target, .anki-rect-multi.drop-target { background-color:rgba(0, 255, 0, 0.3); border:2px dashed green; }
-.anki-controls { margin-top:10px; }
-.anki-controls button { padding:5px 10px; cursor:pointer; margin-right:5px; }
-"""
-    
-    if card_option == "single":
-        rects_html = ""
-        for i, rect in enumerate(rectangles):
-            left_percent = (rect.left() / orig_width) * 100
-            top_percent = (rect.top() / orig_height) * 100
-            width_percent = (rect.width() / orig_width) * 100
-            height_percent = (rect.height() / orig_height) * 100
-            rects_html += f"""
-            <div class="anki-rect" id="rect{i}" data-correct-text="{texts[i] if i < len(texts) else ''}"
-                 style="left:{left_percent}%;top:{top_percent}%;width:{width_percent}%;height:{height_percent}%;z-index:10;"
-                 draggable="false">
-            </div>"""
-            
-        texts_html = "".join([f'<div class="anki-text" id="text{i}" draggable="true">{text}</div>' for i, text in enumerate(shuffled_texts)])
-        
-        return [f"""
-<div class="anki-container" style="{container_style}">
-    <div class="anki-text-container" style="{text_container_style}">{texts_html}</div>
-    <div class="anki-image-container">
-        <img src="{img_filename}" style="z-index:1;">
-        {rects_html}
-    </div>
-    <div class="anki-controls">
-        <button id="showButton_{timestamp}">👁️‍🗨️ Mostrar</button>
-        <button id="hideButton_{timestamp}">👁️ Ocultar</button>
-    </div>
-</div>
-<style>{css}</style>
-"""]
+
+def addon_config():
+    return mw.addonManager.getConfig(__name__) if mw is not None else None
+
+FILMSTRIP_ICON = QSize(96, 72)
+
+def placeholder_image():
+    image = QImage(1, 1, QImage.Format.Format_ARGB32)
+    image.fill(Qt.GlobalColor.transparent)
+    return image
+
+def open_area(slot):
+    cache_key = thumbnail_key(slot.full_path)
+    preview = cached_thumbnail(cache_key)
+    if preview is None:
+        preview = placeholder_image()
+    area = DrawingArea(preview, original_size=slot.original_size)
+    area.cache_key = cache_key
+    if slot.stored:
+        area.load_model(slot.stored)
     else:
-        cards_html = []
-        for i, rect in enumerate(rectangles):
-            left_percent = (rect.left() / orig_width) * 100
-            top_percent = (rect.top() / orig_height) * 100
-            width_percent = (rect.width() / orig_width) * 100
-            height_percent = (rect.height() / orig_height) * 100
-            
-            single_card_texts = texts.copy()
-            random.shuffle(single_card_texts)
-            texts_html = "".join([f'<div class="anki-text" id="text{j}" draggable="true">{text}</div>' for j, text in enumerate(single_card_texts)])
-            
-            cards_html.append(f"""
-<div class="anki-multiple-card" id="card{i}" style="{container_style}">
-    <div class="anki-text-container" style="{text_container_style}">{texts_html}</div>
-    <div style="position:relative; display:inline-block; max-width:100%;">
-        <img src="{img_filename}" style="max-width:100%; width:100%; z-index:1;">
-        <div class="anki-rect-multi" id="rect{i}" data-correct-text="{texts[i] if i < len(texts) else ''}"
-             style="position:absolute; left:{left_percent}%; top:{top_percent}%; 
-                    width:{width_percent}%; height:{height_percent}%; z-index:10;"
-             draggable="false">
-        </div>
-    </div>
-    <div style="margin-top:10px;">
-        <button id="showBtn{i}_{timestamp}">👁️‍🗨️ Mostrar</button>
-        <button id="hideBtn{i}_{timestamp}">👁️ Ocultar</button>
-    </div>
-</div>
-<style>{css}</style>
-""")
-        return cards_html
+        run_with_result(area.offer_layouts, lookup_similar_layouts, os.path.basename(slot.img_path), slot.full_path)
+    load_image_async(slot.full_path, area.show_preview)
+    return area
+
+class ImageSession:
+    def __init__(self, slots, stack, filmstrip, on_select):
+        self.slots = slots
+        self.stack = stack
+        self.filmstrip = filmstrip
+        self.on_select = on_select
+        self.index = -1
+
+    @property
+    def area(self):
+        return self.slots[self.index].area
+
+    def preload(self):
+        for slot in self.slots:
+            preview = cached_thumbnail(thumbnail_key(slot.full_path))
+            if preview is not None:
+                self.set_thumbnail(slot.full_path, preview)
+            else:
+                load_image_async(slot.full_path, self.preview_loaded, PREVIEW_SIZE)
+
+    def set_thumbnail(self, full_path, image):
+        icon = QIcon(QPixmap.fromImage(image.scaled(
+            FILMSTRIP_ICON, Qt.AspectRatioMode.KeepAspectRatio, Qt.TransformationMode.SmoothTransformation
+        )))
+        for index, slot in enumerate(self.slots):
+            if slot.full_path == full_path:
+                self.filmstrip.item(index).setIcon(icon)
+
+    def preview_loaded(self, full_path, levels, full_resolution):
+        image = levels[0]
+        if image.isNull():
+            return
+        store_thumbnail(thumbnail_key(full_path), image)
+        self.set_thumbnail(full_path, image)
+        for slot in self.slots:
+            if slot.full_path == full_path and slot.area is not None:
+                slot.area.show_preview(full_path, levels, False)
+
+    def select(self, index):
+        if index < 0 or index == self.index:
+            return
+        if self.index >= 0:
+            self.area.release_image()
+        slot = self.slots[index]
+        if slot.area is None:
+            slot.area = open_area(slot)
+            self.stack.addWidget(slot.area)
+        elif not slot.area.active:
+            slot.area.active = True
+            load_image_async(slot.full_path, slot.area.show_preview)
+        self.index = index
+        self.stack.setCurrentWidget(slot.area)
+        self.on_select(slot.area)
 
 def show_image_dialog(self):
-    fields = self.note.keys()
-    img_field = None
-    img_path = None
-    for field in fields:
-        content = self.note[field]
-        img_pattern = r'<img[^>]+src=["\'](.*?)["\']'
-        match = re.search(img_pattern, content)
-        if match:
-            img_field = field
-            img_path = match.group(1).split('?')[0]
-            break
+    opened = tracing.now_us()
+    slots = find_note_images(self.note)
     
-    if not img_field:
+    if not slots:
         showInfo("Nenhum campo com imagem encontrado!")
         return
         
     collection = self.note.col
     media_dir = collection.media.dir()
-    full_path = os.path.join(media_dir, img_path)
-    
-    if not os.path.exists(full_path):
-        showInfo(f"Imagem não encontrada: {full_path}")
+    missing = []
+    for slot in slots:
+        slot.full_path = os.path.join(media_dir, slot.img_path)
+        slot.original_size = read_image_size(slot.full_path) if os.path.exists(slot.full_path) else QSize()
+        if not slot.original_size.isValid():
+            missing.append(slot.full_path)
+    slots = [slot for slot in slots if slot.original_size.isValid()]
+    if not slots:
+        showInfo(f"Imagem não encontrada: {missing[0]}")
         return
+    if missing:
+        notify(f"{len(missing)} imagem(ns) não encontrada(s) foram ignoradas.")
         
-    backup_path = full_path + ".backup"
-    if not os.path.exists(backup_path):
-        shutil.copy(full_path, backup_path)
-        
-    original_filename = f"{os.path.splitext(os.path.basename(img_path))[0]}_original.png"
-    original_path = os.path.join(media_dir, original_filename)
-    if not os.path.exists(original_path):
-        shutil.copy(full_path, original_path)
+    for slot in slots:
+        run_in_background(store_original, media_dir, slot.full_path, on_error=partial(original_failed, slot))
         
     dialog = QDialog(self.widget)
-    dialog.setWindowTitle("Imagem do Campo")
+    dialog.setWindowTitle("Imagem do Campo" if len(slots) == 1 else f"Imagens da Nota ({len(slots)})")
     layout = QVBoxLayout()
     
-    pixmap = QPixmap(full_path)
-    if pixmap.isNull():
-        showInfo("Erro ao carregar a imagem!")
-        dialog.close()
-        return
-        
-    max_size = QSize(600, 400)
-    original_size = pixmap.size()
-    pixmap = pixmap.scaled(max_size, Qt.AspectRatioMode.KeepAspectRatio, Qt.TransformationMode.SmoothTransformation)
-    scale_factor = original_size.width() / pixmap.width() if pixmap.width() > 0 else 1.0
+    filmstrip = QListWidget()
+    filmstrip.setViewMode(QListView.ViewMode.IconMode)
+    filmstrip.setFlow(QListView.Flow.LeftToRight)
+    filmstrip.setWrapping(False)
+    filmstrip.setMovement(QListView.Movement.Static)
+    filmstrip.setIconSize(FILMSTRIP_ICON)
+    filmstrip.setFixedHeight(FILMSTRIP_ICON.height() + 48)
+    for index, slot in enumerate(slots):
+        item = QListWidgetItem(f"{index + 1}. {os.path.basename(slot.img_path)}")
+        item.setToolTip(f"{slot.field}: {slot.img_path}")
+        filmstrip.addItem(item)
+    filmstrip.setVisible(len(slots) > 1)
+    layout.addWidget(filmstrip)
     
-    drawing_area = DrawingArea(pixmap)
-    drawing_area.scale_factor = scale_factor
-    drawing_area.original_size = original_size
-    layout.addWidget(drawing_area)
+    stack = QStackedWidget()
+    layout.addWidget(stack)
     
     card_option_layout = QHBoxLayout()
     card_option_layout.addWidget(QLabel("Opções de Card:"))
@@ -241,98 +799,340 @@ def show_image_dialog(self):
     text_position_layout.addWidget(QLabel("Posição dos Textos:"))
     text_position_combo = QComboBox()
     text_position_combo.addItems(["Em cima", "Embaixo", "À esquerda", "À direita"])
-    text_position_combo.currentTextChanged.connect(lambda text: set_text_position(drawing_area, text))
     text_position_layout.addWidget(text_position_combo)
     layout.addLayout(text_position_layout)
     
+    mask_style_layout = QHBoxLayout()
+    mask_style_layout.addWidget(QLabel("Máscaras:"))
+    mask_style_combo = QComboBox()
+    mask_style_combo.addItems(["Divs (compatível)", "SVG (leve)"])
+    mask_style_layout.addWidget(mask_style_combo)
+    layout.addLayout(mask_style_layout)
+    
     button_layout = QHBoxLayout()
     rectangle_button = QPushButton("🟨 Retângulo")
     rectangle_button.setCheckable(True)
-    rectangle_button.clicked.connect(lambda checked: set_rectangle_mode(drawing_area, checked))
     button_layout.addWidget(rectangle_button)
     
+    def sync_controls(drawing_area):
+        drawing_area.rectangle_mode = rectangle_button.isChecked()
+        multi_card_radio.setChecked(drawing_area.card_option == "multiple")
+        single_card_radio.setChecked(drawing_area.card_option != "multiple")
+        text_position_combo.setCurrentIndex(TEXT_POSITIONS.index(drawing_area.text_position))
+        mask_style_combo.setCurrentIndex(1 if drawing_area.mask_style == "svg" else 0)
+    
+    session = ImageSession(slots, stack, filmstrip, sync_controls)
+    multi_card_radio.toggled.connect(lambda checked: setattr(session.area, "card_option", "multiple" if checked else "single"))
+    text_position_combo.currentTextChanged.connect(lambda text: set_text_position(session.area, text))
+    mask_style_combo.currentIndexChanged.connect(lambda index: set_mask_style(session.area, index))
+    rectangle_button.clicked.connect(lambda checked: set_rectangle_mode(session.area, checked))
+    filmstrip.currentRowChanged.connect(session.select)
+    session.preload()
+    first = next((index for index, slot in enumerate(slots) if slot.stored), 0)
+    filmstrip.setCurrentRow(first)
+    session.select(first)
+    
+    fit_button = QPushButton("🔍 Ajustar")
+    fit_button.clicked.connect(lambda: session.area.fit_to_window())
+    button_layout.addWidget(fit_button)
+    
+    detect_layout = QHBoxLayout()
+    detect_button = QPushButton("🔎 Auto-detectar textos")
+    detect_button.clicked.connect(lambda: session.area.detect_labels())
+    detect_layout.addWidget(detect_button)
+    accept_button = QPushButton("✔ Aceitar sugestões")
+    accept_button.clicked.connect(lambda: session.area.accept_candidates())
+    detect_layout.addWidget(accept_button)
+    reject_button = QPushButton("✖ Descartar sugestões")
+    reject_button.clicked.connect(lambda: session.area.reject_candidates())
+    detect_layout.addWidget(reject_button)
+    layout.addLayout(detect_layout)
+    
+    template_button = QPushButton("📐 Salvar modelo")
+    template_button.clicked.connect(lambda: save_template_from_dialog(dialog, session.area, session.area.card_option))
+    button_layout.addWidget(template_button)
+    
     save_button = QPushButton("💾 Salvar")
-    save_button.clicked.connect(lambda: save_image(
-        drawing_area.edited_pixmap, 
-        full_path, 
-        img_field, 
-        img_path, 
-        self, 
-        dialog, 
-        drawing_area,
-        "single" if single_card_radio.isChecked() else "multiple"
-    ))
+    save_button.clicked.connect(lambda: save_images(self, dialog, slots))
     button_layout.addWidget(save_button)
     layout.addLayout(button_layout)
+    QShortcut(QKeySequence.StandardKey.Undo, dialog, activated=lambda: session.area.undo())
+    QShortcut(QKeySequence.StandardKey.Redo, dialog, activated=lambda: session.area.redo())
     dialog.setLayout(layout)
+    dialog.resize(960, 760 + (filmstrip.height() if len(slots) > 1 else 0))
+    if tracing.enabled():
+        tracing.record("dialog.open", opened, tracing.now_us() - opened, args={"images": len(slots)})
     dialog.exec()
+    tracing.flush()
+
+def original_failed(slot, error):
+    slot.original_error = error
+    report_background_error(store_original, error)
 
 def set_rectangle_mode(drawing_area, checked):
     drawing_area.rectangle_mode = checked
 
+TEXT_POSITIONS = ["top", "bottom", "left", "right"]
+
 def set_text_position(drawing_area, text):
     position_map = {"Em cima": "top", "Embaixo": "bottom", "À esquerda": "left", "À direita": "right"}
     drawing_area.text_position = position_map.get(text, "top")
 
-def save_image(pixmap, full_path, img_field, img_path, editor, dialog, drawing_area, card_option="single"):
-    media_dir = os.path.dirname(full_path)
-    img_filename = os.path.basename(img_path)
-    
-    if not img_filename.lower().endswith('.png'):
-        img_filename = os.path.splitext(img_filename)[0] + '.png'
-        full_path = os.path.join(media_dir, img_filename)
-        
-    if not pixmap.save(full_path, "PNG"):
-        showInfo(f"Erro ao salvar a imagem: {full_path}")
+def set_mask_style(drawing_area, index):
+    drawing_area.mask_style = "svg" if index == 1 else "div"
+
+def save_template_from_dialog(dialog, drawing_area, card_option):
+    if not drawing_area.rectangles:
+        showInfo("Nenhum retângulo desenhado para salvar como modelo!")
         return
-        
-    collection = editor.note.col
-    collection.media.add_file(full_path)
-    
-    try:
-        html_contents = generate_html(
-            img_filename, 
-            pixmap, 
-            drawing_area.rectangles, 
-            media_dir, 
-            drawing_area.scale_factor, 
-            drawing_area.timestamp, 
-            card_option, 
-            drawing_area.texts,
-            drawing_area.text_position
-        )
-    except FileNotFoundError as e:
-        showInfo(str(e))
+    name, ok = QInputDialog.getText(dialog, "Salvar modelo", "Nome do modelo:")
+    if ok and name.strip():
+        save_template(name.strip(), drawing_area, card_option)
+        showInfo(f"Modelo \"{name.strip()}\" salvo!")
+
+def slot_model(slot, img_filename=None):
+    area = slot.area
+    size = area.original_size
+    return build_model(img_filename or os.path.basename(slot.img_path), size.width(), size.height(), area.rectangles,
+                       area.texts, area.card_option, area.text_position, area.mask_style, area.store.ids)
+
+def slot_changed(slot):
+    area = slot.area
+    if area is None:
+        return False
+    if area.stored_model is None:
+        return bool(len(area.store))
+    return not same_content(slot_model(slot), area.stored_model)
+
+def save_images(editor, dialog, slots):
+    pending = [slot for slot in slots if slot_changed(slot)]
+    if not pending:
+        notify("Nenhuma alteração para salvar.")
+        dialog.close()
         return
-        
-    if card_option == "single":
-        editor.note[img_field] = html_contents[0]
-        if editor.note.id != 0:
-            editor.note.flush()
-        editor.loadNoteKeepingFocus()
-    else:
-        if not drawing_area.rectangles:
-            showInfo("Nenhum retângulo desenhado para criar cards!")
+    SaveBatch(editor, dialog, pending).start()
+
+class SaveBatch:
+    def __init__(self, editor, dialog, slots):
+        self.editor = editor
+        self.dialog = dialog
+        self.slots = slots
+        self.results = [None] * len(slots)
+        self.remaining = 0
+        self.started = tracing.now_us()
+
+    def start(self):
+        settings = encoding_settings(addon_config())
+        jobs = [index for index, slot in enumerate(self.slots)
+                if needs_reencode(slot.full_path, slot.area.original_size, settings)]
+        if not jobs:
+            self.finish()
+            return
+        unsafe = [self.slots[index] for index in jobs if self.slots[index].original_error]
+        if unsafe:
+            showInfo(f"O original de {os.path.basename(unsafe[0].img_path)} não pôde ser guardado "
+                     f"({unsafe[0].original_error}); a imagem não será regravada.")
+            return
+        self.remaining = len(jobs)
+        self.dialog.setEnabled(False)
+        for index in jobs:
+            run_with_result(partial(self.encoded, index), reencode, self.slots[index].full_path, settings)
+
+    def encoded(self, index, result):
+        self.results[index] = result
+        self.remaining -= 1
+        if self.remaining == 0:
+            self.finish()
+
+    def finish(self):
+        try:
+            self.write()
+        finally:
+            if tracing.enabled():
+                tracing.record("save.total", self.started, tracing.now_us() - self.started, args={"images": len(self.slots)})
+
+    @tracing.traced("save.finish")
+    def write(self):
+        self.dialog.setEnabled(True)
+        errors = [result for result in self.results if isinstance(result, Exception)]
+        if errors:
+            showInfo(f"Erro ao salvar a imagem: {errors[0]}")
             return
+        note = self.editor.note
+        collection = note.col
+        ensure_media_assets(collection)
+        replacements = []
+        extra_cards = []
+        set_cards = []
+        reports = []
+        for slot, result in zip(self.slots, self.results):
+            area = slot.area
+            media_dir = os.path.dirname(slot.full_path)
+            img_filename = os.path.basename(slot.img_path)
+            if result is not None:
+                img_filename = collection.media.add_file(result["path"])
+                if img_filename != os.path.basename(slot.img_path):
+                    record_output(media_dir, img_filename, os.path.basename(slot.img_path))
+                reports.append(encoding_report(img_filename, result))
+            if area.card_option == "multiple" and not area.rectangles:
+                showInfo("Nenhum retângulo desenhado para criar cards!")
+                return
+            stored = area.stored_model
+            in_set = (area.card_option == "multiple" and stored is not None
+                      and stored.get("card_option") == "multiple" and stored.get("card") is not None)
+            try:
+                html_contents = generate_html(
+                    img_filename, 
+                    area.original_size, 
+                    area.rectangles, 
+                    media_dir, 
+                    area.scale_factor, 
+                    area.timestamp, 
+                    area.card_option, 
+                    area.texts,
+                    area.text_position,
+                    area.mask_style,
+                    stored.get("set") if in_set else None,
+                    area.store.ids
+                )
+            except FileNotFoundError as e:
+                showInfo(str(e))
+                return
+            if area.rectangles and area.edited_pixmap.width() > 1:
+                run_in_background(remember_layout, img_filename, area.edited_pixmap, slot_model(slot, img_filename))
+            if in_set:
+                cards = dict(zip(area.store.ids, html_contents))
+                if stored["card"] in cards:
+                    replacements.append((slot, cards[stored["card"]]))
+                set_cards.append((slot, stored, cards))
+            else:
+                replacements.append((slot, html_contents[0]))
+                extra_cards.extend((slot, html) for html in html_contents[1:])
             
-        editor.note[img_field] = html_contents[0]
-        if editor.note.id != 0:
-            editor.note.flush()
-        editor.loadNoteKeepingFocus()
+        original = {field_name: note[field_name] for field_name in note.keys()}
+        for field_name, value in replace_images(original, replacements).items():
+            if value != original[field_name]:
+                note[field_name] = value
+        if note.id != 0:
+            note.flush()
+        self.editor.loadNoteKeepingFocus()
+        if reports:
+            notify("<br>".join(reports))
         
-        if len(html_contents) > 1:
-            model = editor.note.model()
-            deck_id = editor.note.cards()[0].did if editor.note.cards() else editor.mw.col.decks.selected()
-            for i in range(1, len(html_contents)):
-                new_note = editor.mw.col.new_note(model)
-                for field_name in editor.note.keys():
-                    if field_name == img_field:
-                        new_note[field_name] = html_contents[i]
-                    else:
-                        new_note[field_name] = editor.note[field_name]
-                editor.mw.col.add_note(new_note, deck_id)
-            showInfo(f"Criados {len(html_contents)} cards com retângulos!")
-    dialog.close()
+        if extra_cards or set_cards:
+            cards = note.cards()
+            deck_id = cards[0].did if cards else self.editor.mw.col.decks.selected()
+        if extra_cards:
+            field_sets = [card_fields(original, replacements, slot, card_html) for slot, card_html in extra_cards]
+            create_notes_in_background(self.dialog.parentWidget(), note.model(), field_sets, deck_id)
+        for slot, stored, cards in set_cards:
+            sync_set_notes(self.dialog.parentWidget(), note, original, replacements, slot, stored, cards, deck_id)
+        self.dialog.close()
+
+def search_literal(text):
+    return '"' + re.sub(r'([\\"*_:()-])', r'\\\1', text) + '"'
+
+def same_set(model, stored):
+    if stored.get("set"):
+        return model.get("set") == stored["set"]
+    return model.get("set") is None and model["img"] == stored["img"] and model["rects"] == stored["rects"]
+
+def set_members(col, stored):
+    key = stored["set"] if stored.get("set") else stored["img"]
+    members = {}
+    for nid in col.find_notes(f'"{DATA_ATTRIBUTE}" {search_literal(key)}'):
+        note = col.get_note(nid)
+        for slot in find_note_images(note):
+            model = slot.stored
+            if model and "v" in model and model.get("card") is not None and same_set(model, stored):
+                members.setdefault(model["card"], []).append((note, slot))
+    return members
+
+def sync_set_notes(parent, note, original, replacements, slot, stored, cards, deck_id):
+    stats = {"updated": 0, "added": 0, "removed": 0, "stale": stored["card"] not in cards}
+    note_type = note.note_type()
+
+    def op(col):
+        members = set_members(col, stored)
+        pending = {}
+        removed = set()
+        for card, holders in members.items():
+            for member, member_slot in holders:
+                if member.id == note.id:
+                    continue
+                if card not in cards:
+                    removed.add(member.id)
+                    continue
+                model = read_model(cards[card])
+                if same_content(model, member_slot.stored) and model.get("set") == member_slot.stored.get("set"):
+                    continue
+                pending.setdefault(member.id, (member, []))[1].append((member_slot, cards[card]))
+        updated = []
+        for member, items in pending.values():
+            if member.id in removed:
+                continue
+            for field_name, value in replace_images(dict(member.items()), items).items():
+                member[field_name] = value
+            updated.append(member)
+        notes = []
+        for card, card_html in cards.items():
+            if card != stored["card"] and card not in members:
+                new_note = col.new_note(note_type)
+                for field_name, value in card_fields(original, replacements, slot, card_html).items():
+                    new_note[field_name] = value
+                notes.append(new_note)
+        stats["updated"] = len(updated)
+        stats["added"] = len(notes)
+        stats["removed"] = len(removed)
+        undo_entry = col.add_custom_undo_entry("Atualizar cards de oclusão")
+        col.update_notes(updated)
+        if removed:
+            col.remove_notes(list(removed))
+        if notes:
+            add_notes_batched(col, notes, deck_id, "Atualizar cards de oclusão")
+        return col.merge_undo_entries(undo_entry)
+
+    def on_success(changes):
+        message = f"{stats['updated']} cards do conjunto atualizados, {stats['added']} criados."
+        if stats["removed"]:
+            message += f" {stats['removed']} cards de retângulos apagados foram removidos."
+        if stats["stale"]:
+            message += " O retângulo desta nota foi apagado; ela ficou como estava."
+        notify(message)
+
+    CollectionOp(parent=parent or mw, op=op).success(on_success).with_progress("Atualizando cards de oclusão...").run_in_background()
+
+def encoding_report(img_filename, result):
+    quality = "" if result["quality"] in (-1, 100) else f" q{result['quality']}"
+    return (f"{img_filename}: {result['before'] / 1024:.0f} KB → {result['after'] / 1024:.0f} KB "
+            f"({result['format']}{quality}, {result['width']}x{result['height']})")
+
+def create_notes_in_background(parent, model, field_sets, deck_id):
+    total = len(field_sets)
+    stats = {}
+    
+    def op(col):
+        start = time.perf_counter()
+        notes = []
+        for i, fields in enumerate(field_sets):
+            note = col.new_note(model)
+            for field_name, value in fields.items():
+                note[field_name] = value
+            notes.append(note)
+            if i % 20 == 0:
+                report_progress(f"Gerando cards {i + 1}/{total}", i, total)
+        report_progress(f"Salvando {total} cards...", total, total)
+        with tracing.span("notes.add", notes=total):
+            changes = add_notes_batched(col, notes, deck_id, "Adicionar cards de oclusão")
+        stats["seconds"] = time.perf_counter() - start
+        return changes
+        
+    def on_success(changes):
+        seconds = stats.get("seconds", 0)
+        rate = total / seconds if seconds > 0 else total
+        showInfo(f"Criados {total} cards extras com retângulos! ({total} novas notas em {seconds:.2f}s, {rate:.0f} notas/s)")
+        
+    CollectionOp(parent=parent or mw, op=op).success(on_success).with_progress("Criando cards de oclusão...").run_in_background()
 
 def setup_image_button(buttons, editor):
     image_button = editor.addButton(
@@ -345,211 +1145,52 @@ def setup_image_button(buttons, editor):
     buttons.append(image_button)
     return buttons
 
+def inject_reviewer_runtime(web_content, context):
+    if isinstance(context, Reviewer):
+        web_content.body += f"<script>{trace_flag_js()}{REVIEWER_JS}</script>"
+
+def trace_flag_js():
+    return f"window.oclusaoTrace = {'true' if tracing.enabled() else 'false'};"
+
 def add_widgets_button(card):
-    mw.reviewer.web.eval("""
-        console.log('Binding buttons and drag-and-drop for review');
-        var bindButtons = function(attempt) {
-            try {
-                var container = document.querySelector('.anki-container');
-                var multiContainers = document.querySelectorAll('.anki-multiple-card');
-                
-                function initDragAndDrop(container, isMulti, index) {
-                    var texts = container.querySelectorAll('.anki-text');
-                    var rects = container.querySelectorAll(isMulti ? '.anki-rect-multi' : '.anki-rect');
-                    var textContainer = container.querySelector('.anki-text-container');
-                    var imageContainer = container.querySelector('.anki-image-container') || 
-                                        container.querySelector('div[style*="position:relative"]');
-                    
-                    texts.forEach(function(text) {
-                        text.draggable = true;
-                        text.addEventListener('dragstart', function(e) {
-                            e.stopPropagation();
-                            e.dataTransfer.setData('text/plain', text.id);
-                            text.classList.add('dragging');
-                            console.log('Dragging text: ' + text.id);
-                        });
-                        text.addEventListener('dragend', function() {
-                            text.classList.remove('dragging');
-                        });
-                    });
-                    
-                    rects.forEach(function(rect) {
-                        rect.draggable = false;
-                        rect.addEventListener('dragstart', function(e) {
-                            e.preventDefault();
-                            e.stopPropagation();
-                            console.log('Drag attempt on rect ' + rect.id + ' blocked');
-                        });
-                        rect.addEventListener('dragover', function(e) {
-                            e.preventDefault();
-                            if (!container.querySelector('.anki-text[data-rect-id="' + rect.id + '"]')) {
-                                rect.classList.add('drop-target');
-                            }
-                        });
-                        rect.addEventListener('dragleave', function() {
-                            rect.classList.remove('drop-target');
-                        });
-                        rect.addEventListener('drop', function(e) {
-                            e.preventDefault();
-                            e.stopPropagation();
-                            rect.classList.remove('drop-target');
-                            if (container.querySelector('.anki-text[data-rect-id="' + rect.id + '"]')) {
-                                console.log('Drop ignored: rect ' + rect.id + ' already has a text');
-                                return;
-                            }
-                            var textId = e.dataTransfer.getData('text');
-                            var textElement = document.getElementById(textId);
-                            if (textElement) {
-                                var correctText = rect.getAttribute('data-correct-text');
-                                console.log('Comparing text: "' + textElement.textContent + '" with correct: "' + correctText + '"');
-                                if (textElement.textContent.trim() === correctText.trim()) {
-                                    textElement.classList.remove('incorrect');
-                                    textElement.classList.add('correct');
-                                    console.log('Correct drop: ' + textElement.textContent + ' on rect ' + rect.id);
-                                } else {
-                                    textElement.classList.remove('correct');
-                                    textElement.classList.add('incorrect');
-                                    console.log('Incorrect drop: ' + textElement.textContent + ' on rect ' + rect.id);
-                                }
-                                container.appendChild(textElement);
-                                textElement.classList.remove('free');
-                                textElement.style.position = 'absolute';
-                                var rectBounds = rect.getBoundingClientRect();
-                                var containerBounds = container.getBoundingClientRect();
-                                var left = rectBounds.left - containerBounds.left + (rectBounds.width / 2);
-                                var top = rectBounds.top - containerBounds.top + (rectBounds.height / 2);
-                                textElement.style.left = left + 'px';
-                                textElement.style.top = top + 'px';
-                                textElement.style.transform = 'translate(-50%, -50%)';
-                                textElement.setAttribute('data-rect-id', rect.id);
-                            }
-                        });
-                    });
-                    
-                    if (textContainer) {
-                        textContainer.addEventListener('dragover', function(e) {
-                            e.preventDefault();
-                            textContainer.classList.add('drop-target');
-                        });
-                        textContainer.addEventListener('dragleave', function() {
-                            textContainer.classList.remove('drop-target');
-                        });
-                        textContainer.addEventListener('drop', function(e) {
-                            e.preventDefault();
-                            e.stopPropagation();
-                            textContainer.classList.remove('drop-target');
-                            var textId = e.dataTransfer.getData('text');
-                            var textElement = document.getElementById(textId);
-                            if (textElement) {
-                                textElement.classList.remove('correct', 'incorrect', 'free');
-                                textElement.style.removeProperty('position');
-                                textElement.style.removeProperty('left');
-                                textElement.style.removeProperty('top');
-                                textElement.style.removeProperty('transform');
-                                textElement.removeAttribute('data-rect-id');
-                                textContainer.appendChild(textElement);
-                                console.log('Text returned to container: ' + textElement.textContent);
-                            }
-                        });
-                    }
-                    
-                    container.addEventListener('dragover', function(e) {
-                        e.preventDefault();
-                        container.classList.add('drop-target');
-                    });
-                    container.addEventListener('dragleave', function() {
-                        container.classList.remove('drop-target');
-                    });
-                    container.addEventListener('drop', function(e) {
-                        e.preventDefault();
-                        e.stopPropagation();
-                        container.classList.remove('drop-target');
-                        var dropTarget = e.target;
-                        if (dropTarget.closest('.anki-rect') || dropTarget.closest('.anki-rect-multi') || 
-                            dropTarget.closest('.anki-text-container')) {
-                            return;
-                        }
-                        var textId = e.dataTransfer.getData('text');
-                        var textElement = document.getElementById(textId);
-                        if (textElement) {
-                            var rect = container.getBoundingClientRect();
-                            var x = e.clientX - rect.left;
-                            var y = e.clientY - rect.top;
-                            textElement.classList.remove('correct', 'incorrect');
-                            textElement.classList.add('free');
-                            textElement.style.position = 'absolute';
-                            textElement.style.left = x + 'px';
-                            textElement.style.top = y + 'px';
-                            textElement.style.transform = 'none';
-                            textElement.removeAttribute('data-rect-id');
-                            container.appendChild(textElement);
-                            console.log('Text dropped freely at (' + x + ', ' + y + '): ' + textElement.textContent);
-                        }
-                    });
-                }
-                
-                if (container) {
-                    var showBtn = container.querySelector('[id^="showButton_"]');
-                    var hideBtn = container.querySelector('[id^="hideButton_"]');
-                    if (showBtn) {
-                        showBtn.onclick = function() {
-                            document.querySelectorAll('.anki-rect').forEach(function(rect) {
-                                rect.style.display = 'block';
-                                rect.style.removeProperty('display');
-                                console.log('Show button reset display for rect ' + rect.id);
-                            });
-                            console.log('Show button clicked');
-                        };
-                    }
-                    if (hideBtn) {
-                        hideBtn.onclick = function() {
-                            document.querySelectorAll('.anki-rect').forEach(function(rect) {
-                                rect.style.display = 'none';
-                                console.log('Hide button set none for rect ' + rect.id);
-                            });
-                            console.log('Hide button clicked');
-                        };
-                    }
-                    initDragAndDrop(container, false);
-                }
-                
-                multiContainers.forEach(function(multiContainer, index) {
-                    var showBtn = multiContainer.querySelector('[id^="showBtn' + index + '_"]');
-                    var hideBtn = multiContainer.querySelector('[id^="hideBtn' + index + '_"]');
-                    if (showBtn) {
-                        showBtn.onclick = function() {
-                            var rect = multiContainer.querySelector('#rect' + index);
-                            if (rect) {
-                                rect.style.display = 'block';
-                                rect.style.removeProperty('display');
-                                console.log('Show button ' + index + ' reset display for rect' + index);
-                            }
-                            console.log('Show button ' + index + ' clicked');
-                        };
-                    }
-                    if (hideBtn) {
-                        hideBtn.onclick = function() {
-                            var rect = multiContainer.querySelector('#rect' + index);
-                            if (rect) {
-                                rect.style.display = 'none';
-                                console.log('Hide button ' + index + ' set none for rect' + index);
-                            }
-                            console.log('Hide button ' + index + ' clicked');
-                        };
-                    }
-                    initDragAndDrop(multiContainer, true, index);
-                });
-                
-                console.log('Button binding and drag-and-drop complete, attempt: ' + attempt);
-            } catch (e) {
-                console.log('Button binding error, attempt: ' + attempt + ', error: ' + e.message);
-                if (attempt < 3) {
-                    setTimeout(function() { bindButtons(attempt + 1); }, 1000);
-                }
-            }
-        };
-        setTimeout(function() { bindButtons(1); }, 2000);
-    """)
+    mw.reviewer.web.eval(trace_flag_js() + READY_JS)
+
+PREFETCH_AHEAD = 2
+
+def upcoming_images(col, current_id):
+    if not hasattr(col.sched, "get_queued_cards"):
+        return []
+    images = []
+    for entry in col.sched.get_queued_cards(fetch_limit=PREFETCH_AHEAD + 1).cards:
+        if entry.card.id == current_id:
+            continue
+        for slot in find_note_images(col.get_note(entry.card.note_id)):
+            if slot.stored and slot.img_path not in images:
+                images.append(slot.img_path)
+    return images[:PREFETCH_AHEAD]
+
+def send_prefetch(images):
+    if images and mw.state == "review" and mw.reviewer.web is not None:
+        mw.reviewer.web.eval(f"if (window.oclusao && window.oclusao.prefetch) {{ window.oclusao.prefetch({json.dumps(images)}); }}")
+
+def prefetch_upcoming(card):
+    current_id = card.id
+    QueryOp(
+        parent=mw,
+        op=lambda col: upcoming_images(col, current_id),
+        success=send_prefetch
+    ).failure(lambda error: None).run_in_background()
 
 gui_hooks.editor_did_init_buttons.append(setup_image_button)
-gui_hooks.reviewer_did_show_question.append(add_widgets_button)
\ No newline at end of file
+gui_hooks.webview_will_set_content.append(inject_reviewer_runtime)
+gui_hooks.reviewer_did_show_question.append(add_widgets_button)
+gui_hooks.reviewer_did_show_question.append(prefetch_upcoming)
+gui_hooks.profile_did_open.append(lambda: ensure_media_assets(mw.col))
+gui_hooks.profile_will_close.append(tracing.flush)
+gui_hooks.webview_did_receive_js_message.append(tracing.handle_js_message)
+setup_browser_action()
+if mw is not None:
+    setup_migration_action()
+    setup_transfer_actions()
+    setup_gc_action()
+    tracing.setup_trace_actions(mw)
\ No newline at end of file
@@ -0,0 +1,437 @@
+import os
+import re
+
+ASSET_VERSION = 8
+CSS_FILENAME = "_oclusao.css"
+JS_FILENAME = "_oclusao.js"
+ASSET_TAGS = f'<link rel="stylesheet" href="{CSS_FILENAME}"><script src="{JS_FILENAME}"></script>'
+
+CSS = """
+.anki-container { max-width:100%; min-height:100px; }
+.anki-text-container { background-color:#e0e0e0; padding:5px; border:1px solid #ccc; min-height:30px; }
+.anki-text-container.drop-target { background-color:#d0d0d0; border:1px dashed #000; }
+.anki-container.drop-target { background-color:rgba(200, 200, 200, 0.2); border:1px dashed #000; }
+.anki-text { padding:5px 10px; background-color:#f0f0f0; border:1px solid #000; cursor:move; user-select:none; z-index:20; position:static; }
+.anki-text.dragging { opacity:0.5; }
+.anki-text.correct { background-color:#00ff00; }
+.anki-text.incorrect { background-color:#ff0000; }
+.anki-text.free { position:absolute; }
+.anki-image-container { position:relative; display:inline-block; max-width:100%; }
+.anki-image-container img { max-width:100%; width:100%; display:block; }
+.anki-rect, .anki-rect-multi { position:absolute; background-color:yellow; border:2px solid black; cursor:pointer; display:block; }
+.anki-rect:hover, .anki-rect-multi:hover { display:none; }
+.anki-rect.drop-target, .anki-rect-multi.drop-target { background-color:rgba(0, 255, 0, 0.3); border:2px dashed green; }
+.anki-mask-layer { position:absolute; left:0; top:0; width:100%; height:100%; z-index:10; }
+.anki-mask { fill:yellow; stroke:black; stroke-width:2px; vector-effect:non-scaling-stroke; pointer-events:none; }
+.anki-mask.peek { fill-opacity:0; stroke-opacity:0; }
+.anki-mask.drop-target { fill:rgba(0, 255, 0, 0.3); stroke:green; stroke-dasharray:4 2; }
+.anki-controls { margin-top:10px; }
+.anki-controls button { padding:5px 10px; cursor:pointer; margin-right:5px; }
+"""
+
+REVIEWER_JS = """
+(function() {
+    if (window.oclusao) {
+        window.oclusao.ready();
+        return;
+    }
+    var CARD_SELECTOR = '.anki-container, .anki-multiple-card';
+    var RECT_SELECTOR = '.anki-rect, .anki-rect-multi, .anki-mask';
+    var GRID_CELLS = 32;
+    var PREFETCH_LIMIT = 6;
+    var prefetched = [];
+    var highlighted = null;
+    var peeked = null;
+    var grids = new WeakMap();
+
+    function maskGrid(layer) {
+        var grid = grids.get(layer);
+        if (grid) {
+            return grid;
+        }
+        var box = layer.viewBox.baseVal;
+        var cell = Math.max(box.width, box.height) / GRID_CELLS || 1;
+        grid = {cell: cell, cols: Math.ceil(box.width / cell) + 1, buckets: {}};
+        layer.querySelectorAll('.anki-mask').forEach(function(mask) {
+            var x = mask.x.baseVal.value, y = mask.y.baseVal.value;
+            var w = mask.width.baseVal.value, h = mask.height.baseVal.value;
+            for (var cy = Math.floor(y / cell); cy <= Math.floor((y + h) / cell); cy++) {
+                for (var cx = Math.floor(x / cell); cx <= Math.floor((x + w) / cell); cx++) {
+                    var key = cy * grid.cols + cx;
+                    (grid.buckets[key] = grid.buckets[key] || []).push(mask);
+                }
+            }
+        });
+        grids.set(layer, grid);
+        return grid;
+    }
+
+    function maskAt(layer, clientX, clientY) {
+        var bounds = layer.getBoundingClientRect();
+        if (!bounds.width || !bounds.height) {
+            return null;
+        }
+        var box = layer.viewBox.baseVal;
+        var x = (clientX - bounds.left) * box.width / bounds.width;
+        var y = (clientY - bounds.top) * box.height / bounds.height;
+        var grid = maskGrid(layer);
+        var bucket = grid.buckets[Math.floor(y / grid.cell) * grid.cols + Math.floor(x / grid.cell)] || [];
+        for (var i = bucket.length - 1; i >= 0; i--) {
+            var mask = bucket[i];
+            var mx = mask.x.baseVal.value, my = mask.y.baseVal.value;
+            if (x >= mx && y >= my && x <= mx + mask.width.baseVal.value && y <= my + mask.height.baseVal.value) {
+                return mask;
+            }
+        }
+        return null;
+    }
+
+    function targetElement(e) {
+        var layer = e.target.closest ? e.target.closest('.anki-mask-layer') : null;
+        return layer ? maskAt(layer, e.clientX, e.clientY) || layer : e.target;
+    }
+
+    function traceSpan(name, start) {
+        if (window.oclusaoTrace && typeof pycmd === 'function') {
+            pycmd('oclusao-trace:' + JSON.stringify({name: name, dur: performance.now() - start}));
+        }
+    }
+
+    function currentImagesLoaded() {
+        var pending = Array.prototype.filter.call(document.querySelectorAll('img'), function(img) {
+            return !img.complete;
+        });
+        return Promise.all(pending.map(function(img) {
+            return new Promise(function(resolve) {
+                img.addEventListener('load', resolve, {once: true});
+                img.addEventListener('error', resolve, {once: true});
+            });
+        }));
+    }
+
+    function prefetchImage(url) {
+        for (var i = 0; i < prefetched.length; i++) {
+            if (prefetched[i].url === url) {
+                prefetched.push(prefetched.splice(i, 1)[0]);
+                return;
+            }
+        }
+        var img = new Image();
+        var start = performance.now();
+        img.decoding = 'async';
+        img.src = url;
+        if (img.decode) {
+            img.decode().then(function() {
+                traceSpan('reviewer.prefetch_decode', start);
+            }, function() {});
+        }
+        prefetched.push({url: url, img: img});
+        if (prefetched.length > PREFETCH_LIMIT) {
+            prefetched.shift();
+        }
+    }
+
+    function shuffled(items) {
+        for (var i = items.length - 1; i > 0; i--) {
+            var j = Math.floor(Math.random() * (i + 1));
+            var swap = items[i];
+            items[i] = items[j];
+            items[j] = swap;
+        }
+        return items;
+    }
+
+    function cardLabels(card) {
+        var model;
+        try {
+            model = JSON.parse(card.getAttribute('data-oclusao') || 'null');
+        } catch (e) {
+            return [];
+        }
+        return model && model.texts ? model.texts : [];
+    }
+
+    function buildTextBank(card) {
+        var bank = card.querySelector('.anki-text-container');
+        if (!bank || bank.hasAttribute('data-ready')) {
+            return;
+        }
+        var texts = Array.prototype.slice.call(bank.querySelectorAll('.anki-text'));
+        if (!texts.length) {
+            texts = cardLabels(card).map(function(label, i) {
+                var text = document.createElement('div');
+                text.className = 'anki-text';
+                text.id = 'text' + i;
+                text.textContent = label;
+                return text;
+            });
+        }
+        bank.setAttribute('data-ready', '');
+        var fragment = document.createDocumentFragment();
+        shuffled(texts).forEach(function(text) {
+            fragment.appendChild(text);
+        });
+        bank.appendChild(fragment);
+    }
+
+    function cardOf(el) {
+        return el && el.closest ? el.closest(CARD_SELECTOR) : null;
+    }
+
+    function dropTargetOf(el) {
+        var card = cardOf(el);
+        if (!card) {
+            return null;
+        }
+        var rect = el.closest(RECT_SELECTOR);
+        if (rect) {
+            if (card.querySelector('.anki-text[data-rect-id="' + rect.id + '"]')) {
+                return null;
+            }
+            return rect;
+        }
+        return el.closest('.anki-text-container') || card;
+    }
+
+    function highlight(el) {
+        if (highlighted === el) {
+            return;
+        }
+        if (highlighted) {
+            highlighted.classList.remove('drop-target');
+        }
+        highlighted = el;
+        if (el) {
+            el.classList.add('drop-target');
+        }
+    }
+
+    function resetText(textElement) {
+        textElement.style.removeProperty('position');
+        textElement.style.removeProperty('left');
+        textElement.style.removeProperty('top');
+        textElement.style.removeProperty('transform');
+        textElement.removeAttribute('data-rect-id');
+    }
+
+    function dropOnRect(card, rect, textElement) {
+        var correctText = rect.getAttribute('data-correct-text') || '';
+        var correct = textElement.textContent.trim() === correctText.trim();
+        textElement.classList.remove('correct', 'incorrect', 'free');
+        textElement.classList.add(correct ? 'correct' : 'incorrect');
+        card.appendChild(textElement);
+        var rectBounds = rect.getBoundingClientRect();
+        var cardBounds = card.getBoundingClientRect();
+        textElement.style.position = 'absolute';
+        textElement.style.left = (rectBounds.left - cardBounds.left + rectBounds.width / 2) + 'px';
+        textElement.style.top = (rectBounds.top - cardBounds.top + rectBounds.height / 2) + 'px';
+        textElement.style.transform = 'translate(-50%, -50%)';
+        textElement.setAttribute('data-rect-id', rect.id);
+    }
+
+    function dropOnBank(bank, textElement) {
+        textElement.classList.remove('correct', 'incorrect', 'free');
+        resetText(textElement);
+        bank.appendChild(textElement);
+    }
+
+    function dropFree(card, textElement, e) {
+        var bounds = card.getBoundingClientRect();
+        textElement.classList.remove('correct', 'incorrect');
+        textElement.classList.add('free');
+        resetText(textElement);
+        textElement.style.position = 'absolute';
+        textElement.style.left = (e.clientX - bounds.left) + 'px';
+        textElement.style.top = (e.clientY - bounds.top) + 'px';
+        textElement.style.transform = 'none';
+        card.appendChild(textElement);
+    }
+
+    document.addEventListener('dragstart', function(e) {
+        var target = e.target;
+        if (!target.closest || !cardOf(target)) {
+            return;
+        }
+        if (target.closest(RECT_SELECTOR)) {
+            e.preventDefault();
+            return;
+        }
+        var text = target.closest('.anki-text');
+        if (text) {
+            e.dataTransfer.setData('text/plain', text.id);
+            text.classList.add('dragging');
+        }
+    });
+
+    document.addEventListener('dragend', function(e) {
+        if (e.target.classList && e.target.classList.contains('anki-text')) {
+            e.target.classList.remove('dragging');
+        }
+        highlight(null);
+    });
+
+    document.addEventListener('dragover', function(e) {
+        if (!cardOf(e.target)) {
+            return;
+        }
+        e.preventDefault();
+        highlight(dropTargetOf(targetElement(e)));
+    });
+
+    document.addEventListener('drop', function(e) {
+        var card = cardOf(e.target);
+        if (!card) {
+            return;
+        }
+        e.preventDefault();
+        highlight(null);
+        var textElement = document.getElementById(e.dataTransfer.getData('text'));
+        var target = dropTargetOf(targetElement(e));
+        if (!textElement || !target) {
+            return;
+        }
+        if (target.matches(RECT_SELECTOR)) {
+            dropOnRect(card, target, textElement);
+        } else if (target.classList.contains('anki-text-container')) {
+            dropOnBank(target, textElement);
+        } else {
+            dropFree(card, textElement, e);
+        }
+    });
+
+    document.addEventListener('mousemove', function(e) {
+        var mask = null;
+        var layer = e.target.closest ? e.target.closest('.anki-mask-layer') : null;
+        if (layer) {
+            mask = maskAt(layer, e.clientX, e.clientY);
+        }
+        if (mask === peeked) {
+            return;
+        }
+        if (peeked) {
+            peeked.classList.remove('peek');
+        }
+        peeked = mask;
+        if (mask) {
+            mask.classList.add('peek');
+        }
+    });
+
+    document.addEventListener('click', function(e) {
+        var button = e.target.closest ? e.target.closest('button') : null;
+        var card = cardOf(button);
+        if (!card || !button.id) {
+            return;
+        }
+        var show = /^show(Button_|Btn)/.test(button.id);
+        var hide = /^hide(Button_|Btn)/.test(button.id);
+        if (!show && !hide) {
+            return;
+        }
+        card.querySelectorAll(RECT_SELECTOR).forEach(function(rect) {
+            if (show) {
+                rect.style.removeProperty('display');
+            } else {
+                rect.style.display = 'none';
+            }
+        });
+    });
+
+    window.oclusao = {
+        ready: function() {
+            var start = performance.now();
+            highlight(null);
+            var cards = document.querySelectorAll(CARD_SELECTOR);
+            cards.forEach(function(card) {
+                buildTextBank(card);
+                card.querySelectorAll('.anki-text').forEach(function(text) {
+                    text.draggable = true;
+                });
+                var img = card.querySelector('img');
+                if (img && !img.complete) {
+                    img.addEventListener('load', function() {
+                        traceSpan('reviewer.image_load', start);
+                    }, {once: true});
+                }
+            });
+            traceSpan('reviewer.ready', start);
+            return cards.length;
+        },
+        prefetch: function(urls) {
+            currentImagesLoaded().then(function() {
+                urls.forEach(prefetchImage);
+            });
+        }
+    };
+    window.oclusao.ready();
+})();
+"""
+
+READY_JS = "if (window.oclusao) { window.oclusao.ready(); }"
+
+INLINE_STYLE_PATTERN = re.compile(r"<style>(?:(?!</style>).)*?\.anki-container \{(?:(?!</style>).)*</style>", re.DOTALL)
+
+def asset_contents():
+    header = f"oclusao assets v{ASSET_VERSION}"
+    return {
+        CSS_FILENAME: f"/* {header} */\n{CSS.strip()}\n",
+        JS_FILENAME: f"/* {header} */\n{REVIEWER_JS.strip()}\n",
+    }
+
+def ensure_media_assets(col):
+    media_dir = col.media.dir()
+    for filename, content in asset_contents().items():
+        path = os.path.join(media_dir, filename)
+        data = content.encode("utf-8")
+        try:
+            with open(path, "rb") as f:
+                if f.read() == data:
+                    continue
+        except OSError:
+            pass
+        with open(path, "wb") as f:
+            f.write(data)
+
+def compact_field(value):
+    if ".anki-container {" not in value:
+        return value
+    parts = INLINE_STYLE_PATTERN.split(value)
+    if len(parts) == 1:
+        return value
+    return parts[0] + ASSET_TAGS + "".join(parts[1:])
+
+def migrate_notes():
+    from aqt import mw
+    from aqt.operations import CollectionOp
+    from aqt.utils import showInfo
+
+    stats = {"notes": 0, "saved": 0}
+
+    def op(col):
+        ensure_media_assets(col)
+        notes = []
+        for nid in col.find_notes('"anki-text-container"'):
+            note = col.get_note(nid)
+            changed = False
+            for i, value in enumerate(note.fields):
+                compact = compact_field(value)
+                if compact != value:
+                    stats["saved"] += len(value.encode("utf-8")) - len(compact.encode("utf-8"))
+                    note.fields[i] = compact
+                    changed = True
+            if changed:
+                notes.append(note)
+        stats["notes"] = len(notes)
+        return col.update_notes(notes)
+
+    CollectionOp(parent=mw, op=op).success(
+        lambda changes: showInfo(f"{stats['notes']} notas compactadas, {stats['saved'] / 1024:.1f} KB economizados.")
+    ).run_in_background()
+
+def setup_migration_action():
+    from aqt import mw
+    from aqt.qt import QAction, qconnect
+
+    action = QAction("Oclusão: compactar CSS das notas", mw)
+    qconnect(action.triggered, migrate_notes)
+    mw.form.menuTools.addAction(action)
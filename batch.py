@@ -0,0 +1,226 @@
+import os
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from aqt import mw, gui_hooks
+from aqt.qt import QAction, QRect, QInputDialog, qconnect
+from aqt.operations import CollectionOp, QueryOp
+from aqt.utils import showText, tooltip
+from .render import generate_html
+from .imaging import read_image_size
+from .occlusion_data import card_position, pixel_rects
+from .note_images import card_fields, find_note_images, replace_images
+
+TEMPLATES_PATH = os.path.join(os.path.dirname(__file__), "user_files", "templates.json")
+STORED_MASKS_CHOICE = "Retângulos já salvos em cada nota"
+
+def add_notes_batched(col, notes, deck_id, label):
+    if hasattr(col, "add_notes"):
+        from anki.collection import AddNoteRequest
+        return col.add_notes([AddNoteRequest(note=note, deck_id=deck_id) for note in notes])
+    undo_entry = col.add_custom_undo_entry(label)
+    for note in notes:
+        col.add_note(note, deck_id)
+    return col.merge_undo_entries(undo_entry)
+
+def report_progress(label, value, maximum):
+    mw.taskman.run_on_main(lambda: mw.progress.update(label=label, value=value, max=maximum))
+
+def load_templates():
+    try:
+        with open(TEMPLATES_PATH, encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def save_template(name, drawing_area, card_option):
+    width = drawing_area.original_size.width()
+    height = drawing_area.original_size.height()
+    templates = load_templates()
+    templates[name] = {
+        "rects": [[rect.left() / width, rect.top() / height, rect.width() / width, rect.height() / height] for rect in drawing_area.rectangles],
+        "texts": list(drawing_area.texts),
+        "card_option": card_option,
+        "text_position": drawing_area.text_position,
+        "mask_style": drawing_area.mask_style,
+    }
+    os.makedirs(os.path.dirname(TEMPLATES_PATH), exist_ok=True)
+    with open(TEMPLATES_PATH, "w", encoding="utf-8") as f:
+        json.dump(templates, f, ensure_ascii=False, indent=1)
+
+def slot_template(slot, job):
+    return job["template"] or slot.stored
+
+def render_note(job):
+    timings = {"parse": 0.0, "decode": 0.0, "render": 0.0}
+    start = time.perf_counter()
+    result = {"nid": job["nid"], "timings": timings, "fields": dict(job["fields"])}
+    slots = find_note_images(result["fields"])
+    targets = [(slot, slot_template(slot, job)) for slot in slots]
+    targets = [(slot, template) for slot, template in targets if template and template["rects"]]
+    timings["parse"] = time.perf_counter() - start
+    if not slots:
+        result["error"] = "sem imagem"
+        return result
+    if not targets:
+        result["error"] = "sem retângulos"
+        return result
+
+    rendered = []
+    for slot, template in targets:
+        start = time.perf_counter()
+        size = read_image_size(os.path.join(job["media_dir"], slot.img_path))
+        timings["decode"] += time.perf_counter() - start
+        if not size.isValid():
+            result["error"] = f"imagem ilegível: {slot.img_path}"
+            return result
+
+        start = time.perf_counter()
+        rectangles = [QRect(*rect) for rect in pixel_rects(template, size.width(), size.height())]
+        try:
+            html_contents = generate_html(
+                slot.img_path, size, rectangles, job["media_dir"], 1.0, str(int(time.time())),
+                template["card_option"], template["texts"], template["text_position"], template["mask_style"],
+                template.get("set"), template.get("ids")
+            )
+        except FileNotFoundError as e:
+            result["error"] = str(e)
+            return result
+        card = template.get("card")
+        if card is not None:
+            position = card_position(template)
+            if position is None:
+                result["error"] = f"card {card} fora do conjunto de {slot.img_path}"
+                return result
+            html_contents = [html_contents[position]]
+        rendered.append((slot, html_contents))
+        timings["render"] += time.perf_counter() - start
+    result["html"] = rendered
+    return result
+
+def percentile(values, fraction):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+def timing_summary(results, cancelled, elapsed, skipped=()):
+    done = [r for r in results if "html" in r and r["nid"] not in skipped]
+    failed = [r for r in results if "error" in r]
+    lines = [
+        f"Notas processadas: {len(done)}",
+        f"Ignoradas (editadas durante o lote): {len(skipped)}",
+        f"Falhas: {len(failed)}",
+        f"Tempo total: {elapsed:.2f}s ({len(results) / elapsed if elapsed > 0 else 0:.1f} notas/s)",
+    ]
+    if cancelled:
+        lines.insert(0, "Cancelado: nenhuma nota foi alterada.")
+    lines.append("")
+    for stage in ("parse", "decode", "render"):
+        values = [r["timings"][stage] * 1000 for r in results if stage in r["timings"]]
+        if values:
+            lines.append(f"{stage}: p50 {percentile(values, 0.5):.2f} ms, p95 {percentile(values, 0.95):.2f} ms, total {sum(values):.0f} ms")
+    slowest = sorted(results, key=lambda r: sum(r["timings"].values()), reverse=True)[:10]
+    if slowest:
+        lines.append("")
+        lines.append("Notas mais lentas:")
+        for r in slowest:
+            lines.append(f"  {r['nid']}: {sum(r['timings'].values()) * 1000:.1f} ms {r.get('error', '')}")
+    if skipped:
+        lines.append("")
+        lines.append("Ignoradas por terem sido editadas durante o lote:")
+        for nid in sorted(skipped)[:50]:
+            lines.append(f"  {nid}")
+    if failed:
+        lines.append("")
+        lines.append("Falhas:")
+        for r in failed[:50]:
+            lines.append(f"  {r['nid']}: {r['error']}")
+    return "\n".join(lines)
+
+def apply_batch(browser, nids, template):
+    start = time.perf_counter()
+    state = {"cancelled": False}
+
+    def compute(col):
+        media_dir = col.media.dir()
+        jobs = []
+        for nid in nids:
+            note = col.get_note(nid)
+            jobs.append({"nid": nid, "fields": list(note.items()), "media_dir": media_dir, "template": template})
+        results = []
+        with ThreadPoolExecutor(max_workers=os.cpu_count() or 4) as pool:
+            futures = [pool.submit(render_note, job) for job in jobs]
+            for future in as_completed(futures):
+                results.append(future.result())
+                if len(results) % 10 == 0:
+                    report_progress(f"Oclusão em lote {len(results)}/{len(jobs)}", len(results), len(jobs))
+                if mw.progress.want_cancel():
+                    state["cancelled"] = True
+                    for pending in futures:
+                        pending.cancel()
+                    break
+        return results
+
+    def write(col, results, skipped):
+        updated = []
+        new_notes = {}
+        for result in results:
+            if "html" not in result:
+                continue
+            note = col.get_note(result["nid"])
+            original = dict(note.items())
+            if original != result["fields"]:
+                skipped.add(result["nid"])
+                continue
+            replacements = [(slot, html_contents[0]) for slot, html_contents in result["html"]]
+            for field_name, value in replace_images(original, replacements).items():
+                note[field_name] = value
+            updated.append(note)
+            extra_cards = [(slot, card_html) for slot, html_contents in result["html"] for card_html in html_contents[1:]]
+            if extra_cards:
+                cards = note.cards()
+                deck_id = cards[0].did if cards else col.decks.selected()
+                for slot, card_html in extra_cards:
+                    new_note = col.new_note(note.note_type())
+                    for field_name, value in card_fields(original, replacements, slot, card_html).items():
+                        new_note[field_name] = value
+                    new_notes.setdefault(deck_id, []).append(new_note)
+        undo_entry = col.add_custom_undo_entry("Oclusão em lote")
+        col.update_notes(updated)
+        for deck_id, notes in new_notes.items():
+            add_notes_batched(col, notes, deck_id, "Oclusão em lote")
+        return col.merge_undo_entries(undo_entry)
+
+    def on_computed(results):
+        elapsed = time.perf_counter() - start
+        if state["cancelled"] or not any("html" in r for r in results):
+            showText(timing_summary(results, state["cancelled"], elapsed), parent=browser)
+            return
+        skipped = set()
+        CollectionOp(parent=browser, op=lambda col: write(col, results, skipped)).success(
+            lambda changes: showText(timing_summary(results, False, elapsed, skipped), parent=browser)
+        ).with_progress("Gravando notas...").run_in_background()
+
+    QueryOp(parent=browser, op=compute, success=on_computed).with_progress("Oclusão em lote...").run_in_background()
+
+def batch_occlusion(browser):
+    nids = browser.selected_notes() if hasattr(browser, "selected_notes") else browser.selectedNotes()
+    if not nids:
+        tooltip("Nenhuma nota selecionada.")
+        return
+    templates = load_templates()
+    choices = [STORED_MASKS_CHOICE] + sorted(templates)
+    choice, ok = QInputDialog.getItem(browser, "Oclusão em lote", f"Aplicar em {len(nids)} notas:", choices, 0, False)
+    if not ok:
+        return
+    apply_batch(browser, nids, templates.get(choice))
+
+def add_browser_action(browser):
+    action = QAction("Oclusão em lote...", browser)
+    qconnect(action.triggered, lambda: batch_occlusion(browser))
+    browser.form.menuEdit.addSeparator()
+    browser.form.menuEdit.addAction(action)
+
+def setup_browser_action():
+    gui_hooks.browser_menus_did_init.append(add_browser_action)
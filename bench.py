@@ -0,0 +1,432 @@
+import os
+import sys
+import json
+import tempfile
+import time
+import random
+import argparse
+import statistics
+import importlib.util
+
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+
+ADDON_DIR = os.path.dirname(os.path.abspath(__file__))
+THRESHOLDS_PATH = os.path.join(ADDON_DIR, "bench_thresholds.json")
+
+def load_addon():
+    spec = importlib.util.spec_from_file_location(
+        "oclusao", os.path.join(ADDON_DIR, "__init__.py"),
+        submodule_search_locations=[ADDON_DIR]
+    )
+    module = importlib.util.module_from_spec(spec)
+    sys.modules["oclusao"] = module
+    spec.loader.exec_module(module)
+    return module
+
+def random_rects(QRect, count, width, height, seed=1):
+    rng = random.Random(seed)
+    rects = []
+    for _ in range(count):
+        w = rng.randint(20, 120)
+        h = rng.randint(10, 60)
+        rects.append(QRect(rng.randint(0, width - w), rng.randint(0, height - h), w, h))
+    return rects
+
+def legacy_update(label, base, rectangles, current_rect, QPainter, QColor, QPen, Qt):
+    pixmap = base.copy()
+    painter = QPainter(pixmap)
+    yellow_solid = QColor(255, 255, 0, 255)
+    for rect in rectangles:
+        painter.fillRect(rect, yellow_solid)
+        painter.setPen(QPen(Qt.GlobalColor.black, 2))
+        painter.drawRect(rect)
+    if current_rect:
+        painter.fillRect(current_rect, yellow_solid)
+        painter.setPen(QPen(Qt.GlobalColor.black, 2))
+        painter.drawRect(current_rect)
+    painter.end()
+    label.setPixmap(pixmap)
+    label.repaint()
+
+def bench_drag(counts=(10, 100, 1000), frames=100, size=(1600, 1200)):
+    addon = load_addon()
+    from aqt.qt import QApplication, QPixmap, QLabel, QRect, QPoint, QPainter, QColor, QPen, Qt
+    app = QApplication.instance() or QApplication(sys.argv)
+    width, height = size
+    base = QPixmap(width, height)
+    base.fill(QColor(200, 200, 200))
+    results = []
+    for count in counts:
+        rectangles = random_rects(QRect, count, width, height)
+        start = QPoint(width // 4, height // 4)
+        drag = [QRect(start, QPoint(start.x() + 4 * i, start.y() + 3 * i)).normalized() for i in range(1, frames + 1)]
+
+        legacy = QLabel()
+        legacy.show()
+        t0 = time.perf_counter()
+        for current_rect in drag:
+            legacy_update(legacy, base, rectangles, current_rect, QPainter, QColor, QPen, Qt)
+        legacy_ms = (time.perf_counter() - t0) * 1000 / frames
+        legacy.close()
+
+        area = addon.DrawingArea(base)
+        for rect in rectangles:
+            area.store.add(rect.x(), rect.y(), rect.width(), rect.height())
+        area.rectangle_mode = True
+        area.show()
+        app.processEvents()
+        t0 = time.perf_counter()
+        previous = None
+        for current_rect in drag:
+            area.current_rect = current_rect
+            dirty = area.rect_bounds(current_rect)
+            if previous is not None:
+                dirty = dirty.united(area.rect_bounds(previous))
+            area.repaint(dirty)
+            previous = current_rect
+        overlay_ms = (time.perf_counter() - t0) * 1000 / frames
+        area.close()
+
+        results.append({"rectangles": count, "legacy_ms": legacy_ms, "overlay_ms": overlay_ms})
+    return results
+
+def bench_hit_test(counts=(100, 1000, 10000, 100000), queries=2000, size=(8000, 6000)):
+    from rect_store import RectStore
+    width, height = size
+    rng = random.Random(2)
+    results = []
+    for count in counts:
+        store = RectStore()
+        boxes = []
+        for _ in range(count):
+            w, h = rng.randint(20, 120), rng.randint(10, 60)
+            box = (rng.randint(0, width - w), rng.randint(0, height - h), w, h)
+            boxes.append(box)
+            store.add(*box)
+        points = [(rng.randrange(width), rng.randrange(height)) for _ in range(queries)]
+
+        t0 = time.perf_counter()
+        for x, y in points:
+            store.hit(x, y)
+        grid_us = (time.perf_counter() - t0) * 1e6 / queries
+
+        t0 = time.perf_counter()
+        for x, y in points:
+            hit = None
+            for i, (bx, by, bw, bh) in enumerate(boxes):
+                if bx <= x < bx + bw and by <= y < by + bh:
+                    hit = i
+        linear_us = (time.perf_counter() - t0) * 1e6 / queries
+
+        results.append({"rectangles": count, "grid_us": grid_us, "linear_us": linear_us})
+    return results
+
+def sample_diagram(width, height, labels=80, seed=3):
+    from aqt.qt import QImage, QPainter, QColor, QFont, QPen
+    rng = random.Random(seed)
+    image = QImage(width, height, QImage.Format.Format_RGB32)
+    image.fill(QColor(245, 240, 230))
+    painter = QPainter(image)
+    painter.setPen(QPen(QColor(120, 60, 60), 6))
+    for _ in range(12):
+        painter.drawEllipse(rng.randrange(width), rng.randrange(height), rng.randint(200, 900), rng.randint(200, 900))
+    painter.setFont(QFont("Sans", max(10, height // 90)))
+    painter.setPen(QColor(20, 20, 20))
+    for i in range(labels):
+        painter.drawText(rng.randrange(width - 300), rng.randrange(40, height), f"Estrutura {i} lateral")
+    painter.end()
+    return image
+
+def bench_detect(sizes=((1920, 1080), (3840, 2160)), runs=3):
+    load_addon()
+    from aqt.qt import QApplication
+    import detect
+    app = QApplication.instance() or QApplication(sys.argv)
+    results = []
+    for width, height in sizes:
+        gray = detect.gray_array(sample_diagram(width, height))
+        samples = []
+        for _ in range(runs):
+            t0 = time.perf_counter()
+            regions = detect.detect_text_regions(gray)
+            samples.append((time.perf_counter() - t0) * 1000)
+        results.append({"size": f"{width}x{height}", "detect_ms": min(samples), "regions": len(regions)})
+    return results
+
+def run_js(page, script):
+    from aqt.qt import QEventLoop
+    loop = QEventLoop()
+    result = {}
+
+    def done(value):
+        result["value"] = value
+        loop.quit()
+
+    page.runJavaScript(script, done)
+    loop.exec()
+    return result.get("value")
+
+def bench_reviewer(counts=(10, 100, 1000), runs=20, size=(1600, 1200)):
+    addon = load_addon()
+    from aqt.qt import QApplication, QEventLoop, QWebEngineView, QRect, QSize
+    app = QApplication.instance() or QApplication(sys.argv)
+    view = QWebEngineView()
+    loop = QEventLoop()
+    view.loadFinished.connect(lambda ok: loop.quit())
+    view.setHtml(f'<html><body><div id="qa"></div><script>{addon.REVIEWER_JS}</script></body></html>')
+    loop.exec()
+    width, height = size
+    results = []
+    with tempfile.TemporaryDirectory() as media_dir:
+        open(os.path.join(media_dir, "bench.png"), "wb").close()
+        for count in counts:
+            rectangles = random_rects(QRect, count, width, height)
+            texts = [f"Texto {i}" for i in range(count)]
+            html = addon.generate_html("bench.png", QSize(width, height), rectangles, media_dir, 1.0, "0", "single", texts)[0]
+            script = f"""(function() {{
+                var qa = document.getElementById('qa');
+                var t0 = performance.now();
+                qa.innerHTML = {json.dumps(html)};
+                window.oclusao.ready();
+                qa.querySelector('button[id^="hide"]').click();
+                var rect = qa.querySelector('.anki-rect');
+                var t1 = performance.now();
+                return rect.style.display === 'none' ? t1 - t0 : -1;
+            }})()"""
+            samples = sorted(run_js(view.page(), script) for _ in range(runs))
+            results.append({"rectangles": count, "tti_ms": samples[len(samples) // 2], "tti_max_ms": samples[-1]})
+    view.close()
+    return results
+
+class StubMedia:
+    def __init__(self, media_dir):
+        self.media_dir = media_dir
+        self.added = []
+
+    def dir(self):
+        return self.media_dir
+
+    def add_file(self, path):
+        self.added.append(path)
+        return os.path.basename(path)
+
+class StubCollection:
+    def __init__(self, media_dir):
+        self.media = StubMedia(media_dir)
+
+class StubNote(dict):
+    def __init__(self, col, fields):
+        super().__init__(fields)
+        self.col = col
+        self.id = 0
+
+class StubEditor:
+    def __init__(self, note):
+        self.note = note
+
+    def loadNoteKeepingFocus(self):
+        pass
+
+class StubDialog:
+    def close(self):
+        pass
+
+    def setEnabled(self, enabled):
+        pass
+
+def median_ms(func, runs):
+    samples = []
+    for _ in range(runs):
+        t0 = time.perf_counter()
+        func()
+        samples.append((time.perf_counter() - t0) * 1000)
+    return statistics.median(samples)
+
+def bench_generate_html(counts=(1, 10, 100, 1000), runs=5, size=(1600, 1200)):
+    addon = load_addon()
+    from aqt.qt import QRect, QSize
+    width, height = size
+    results = []
+    with tempfile.TemporaryDirectory() as media_dir:
+        open(os.path.join(media_dir, "bench.png"), "wb").close()
+        for count in counts:
+            rectangles = random_rects(QRect, count, width, height)
+            texts = [f"Texto {i}" for i in range(count)]
+            row = {"rectangles": count}
+            for mode in ("single", "multiple"):
+                row[f"{mode}_ms"] = median_ms(lambda: addon.generate_html(
+                    "bench.png", QSize(width, height), rectangles, media_dir, 1.0, "0", mode, texts
+                ), 1 if mode == "multiple" and count >= 1000 else runs)
+            results.append(row)
+    return results
+
+def bench_update(counts=(10, 100, 1000), frames=50, size=(1600, 1200)):
+    addon = load_addon()
+    from aqt.qt import QApplication, QImage, QColor, QRect
+    app = QApplication.instance() or QApplication(sys.argv)
+    width, height = size
+    base = QImage(width, height, QImage.Format.Format_RGB32)
+    base.fill(QColor(200, 200, 200))
+    results = []
+    for count in counts:
+        area = addon.DrawingArea(base)
+        for rect in random_rects(QRect, count, width, height):
+            area.store.add(rect.x(), rect.y(), rect.width(), rect.height())
+        area.resize(1200, 900)
+        area.show()
+        app.processEvents()
+
+        def frame():
+            area.update_with_rectangles()
+            app.processEvents()
+
+        results.append({"rectangles": count, "update_ms": median_ms(frame, frames)})
+        area.close()
+    return results
+
+def bench_image_load(sizes=((1920, 1080), (4000, 3000)), runs=3):
+    addon = load_addon()
+    from aqt.qt import QApplication
+    app = QApplication.instance() or QApplication(sys.argv)
+    results = []
+    with tempfile.TemporaryDirectory() as media_dir:
+        for width, height in sizes:
+            image = sample_diagram(width, height)
+            for fmt in ("PNG", "JPG"):
+                path = os.path.join(media_dir, f"load_{width}x{height}.{fmt.lower()}")
+                image.save(path, fmt)
+
+                def open_dialog():
+                    size = addon.read_image_size(path)
+                    preview = addon.decode_image(path, addon.PREVIEW_SIZE)
+                    area = addon.DrawingArea(preview, original_size=size)
+                    area.show()
+                    app.processEvents()
+                    area.close()
+
+                results.append({
+                    "image": f"{width}x{height}.{fmt.lower()}",
+                    "open_ms": median_ms(open_dialog, runs),
+                    "full_decode_ms": median_ms(lambda: addon.decode_image(path), runs),
+                })
+    return results
+
+def bench_save(counts=(10, 100, 1000), runs=3, size=(1600, 1200)):
+    addon = load_addon()
+    import oclusao.phash_index as phash_index
+    from aqt.qt import QApplication, QThreadPool, QRect
+    app = QApplication.instance() or QApplication(sys.argv)
+    width, height = size
+    image = sample_diagram(width, height)
+    results = []
+    with tempfile.TemporaryDirectory() as media_dir:
+        phash_index._index = phash_index.TemplateIndex(os.path.join(media_dir, "phash_index.json"))
+        full_path = os.path.join(media_dir, "bench.png")
+        image.save(full_path, "PNG")
+        col = StubCollection(media_dir)
+        for count in counts:
+            area = addon.DrawingArea(image)
+            for i, rect in enumerate(random_rects(QRect, count, width, height)):
+                area.store.add(rect.x(), rect.y(), rect.width(), rect.height(), f"Texto {i}")
+            note = StubNote(col, {"Frente": '<img src="bench.png">', "Verso": ""})
+            editor = StubEditor(note)
+            slot = addon.find_note_images(note)[0]
+            slot.full_path = full_path
+            slot.area = area
+            row = {"rectangles": count}
+            budget = os.path.getsize(full_path) // 2
+            for label, reencode in (("html_only_ms", False), ("with_encode_ms", True)):
+                config = {"image_encoding": {"reencode_oversized": reencode, "max_bytes": budget}}
+                addon.addon_config = lambda config=config: config
+
+                def save():
+                    note["Frente"] = '<img src="bench.png">'
+                    addon.save_images(editor, StubDialog(), [slot])
+                    QThreadPool.globalInstance().waitForDone()
+                    app.processEvents()
+                    QThreadPool.globalInstance().waitForDone()
+                row[label] = median_ms(save, runs)
+            results.append(row)
+    phash_index._index = None
+    return results
+
+SUITE = (
+    ("generate_html", bench_generate_html),
+    ("update", bench_update),
+    ("image_load", bench_image_load),
+    ("save", bench_save),
+    ("drag", bench_drag),
+    ("hit_test", bench_hit_test),
+    ("detect", bench_detect),
+    ("reviewer", bench_reviewer),
+)
+
+def flatten(results):
+    metrics = {}
+    for name, rows in results.items():
+        for row in rows:
+            key = next(iter(row.values()))
+            for field, value in row.items():
+                if field.endswith(("_ms", "_us")):
+                    metrics[f"{name}.{key}.{field}"] = round(value, 4)
+    return metrics
+
+def run_suite(names=None):
+    results = {}
+    for name, func in SUITE:
+        if names and name not in names:
+            continue
+        results[name] = func()
+    return {
+        "python": sys.version.split()[0],
+        "platform": sys.platform,
+        "timestamp": int(time.time()),
+        "results": results,
+        "metrics": flatten(results),
+    }
+
+def check_regressions(metrics, thresholds=None, baseline=None, tolerance=1.25):
+    failures = []
+    for key, limit in (thresholds or {}).items():
+        if key in metrics and metrics[key] > limit:
+            failures.append(f"{key}: {metrics[key]:.3f} > limite {limit:.3f}")
+    for key, previous in (baseline or {}).items():
+        if key in metrics and previous > 0 and metrics[key] > previous * tolerance:
+            failures.append(f"{key}: {metrics[key]:.3f} > {previous:.3f} x {tolerance:.2f} (baseline)")
+    return failures
+
+def print_report(results):
+    for name, rows in results.items():
+        for row in rows:
+            print(f"{name:>14}  " + "  ".join(
+                f"{field} {value:.3f}" if isinstance(value, float) else f"{field} {value}"
+                for field, value in row.items()
+            ))
+
+def load_json(path):
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmarks headless do add-on de oclusão.")
+    parser.add_argument("names", nargs="*", help="subconjunto de benchmarks: " + ", ".join(name for name, _ in SUITE))
+    parser.add_argument("--json", dest="json_path", help="grava os resultados em JSON neste arquivo")
+    parser.add_argument("--thresholds", default=THRESHOLDS_PATH, help="limites absolutos por métrica (JSON)")
+    parser.add_argument("--baseline", help="resultados JSON anteriores para comparação relativa")
+    parser.add_argument("--tolerance", type=float, default=1.25, help="razão máxima aceita contra o baseline")
+    args = parser.parse_args(argv)
+
+    report = run_suite(args.names)
+    print_report(report["results"])
+    if args.json_path:
+        with open(args.json_path, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+    thresholds = load_json(args.thresholds) if args.thresholds and os.path.exists(args.thresholds) else {}
+    baseline = load_json(args.baseline)["metrics"] if args.baseline else None
+    failures = check_regressions(report["metrics"], thresholds, baseline, args.tolerance)
+    for failure in failures:
+        print(f"REGRESSÃO {failure}", file=sys.stderr)
+    return 1 if failures else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,267 @@
+import os
+import sys
+import csv
+import json
+import time
+import types
+import argparse
+import tempfile
+import importlib
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+ADDON_DIR = os.path.dirname(os.path.abspath(__file__))
+CORE_PACKAGE = "oclusao_core"
+NOTETYPE_NAME = "Oclusão de Imagem"
+IMAGE_FIELD = "Imagem"
+EXTRA_FIELD = "Extra"
+CHUNK_SIZE = 64
+WRITE_BATCH = 1000
+REPORT_EVERY = 5.0
+
+def load_core():
+    if CORE_PACKAGE not in sys.modules:
+        package = types.ModuleType(CORE_PACKAGE)
+        package.__path__ = [ADDON_DIR]
+        sys.modules[CORE_PACKAGE] = package
+    return tuple(importlib.import_module(f"{CORE_PACKAGE}.{name}") for name in ("render", "image_header", "assets"))
+
+render, image_header, assets = load_core()
+CSS_IMPORT = f'@import url("{assets.CSS_FILENAME}");'
+SCRIPT_TAG = f'<script src="{assets.JS_FILENAME}"></script>'
+
+def parse_labels(value):
+    if isinstance(value, list):
+        return [str(label) for label in value]
+    value = (value or "").strip()
+    if value.startswith("["):
+        return [str(label) for label in json.loads(value)]
+    return [label.strip() for label in value.split("|")] if value else []
+
+def parse_boxes(value):
+    if isinstance(value, str):
+        value = json.loads(value) if value.strip() else []
+    return [[float(v) for v in box] for box in value or []]
+
+def iter_manifest(path):
+    with open(path, encoding="utf-8", newline="") as f:
+        if path.lower().endswith(".csv"):
+            for line_no, row in enumerate(csv.DictReader(f), 2):
+                yield line_no, row
+        else:
+            for line_no, line in enumerate(f, 1):
+                if line.strip():
+                    yield line_no, line
+
+def normalize_record(raw, base_dir):
+    image = raw.get("image") or raw.get("img")
+    if not image:
+        raise ValueError("registro sem imagem")
+    return {
+        "image": image if os.path.isabs(image) else os.path.join(base_dir, image),
+        "boxes": parse_boxes(raw.get("boxes")),
+        "labels": parse_labels(raw.get("labels")),
+        "units": raw.get("units") or "auto",
+        "mode": "multiple" if raw.get("mode") in ("multiple", "multi") else "single",
+        "text_position": raw.get("text_position") or "top",
+        "mask_style": raw.get("mask_style") or "div",
+        "extra": raw.get("extra") or "",
+        "tags": parse_labels(raw.get("tags")) if raw.get("tags") else [],
+    }
+
+def pixel_boxes(boxes, units, width, height):
+    fractional = units == "fraction" or (units == "auto" and all(v <= 1 for box in boxes for v in box))
+    if fractional:
+        boxes = [[x * width, y * height, w * width, h * height] for x, y, w, h in boxes]
+    boxes = [tuple(int(round(v)) for v in box) for box in boxes]
+    for i, (x, y, w, h) in enumerate(boxes):
+        if w <= 0 or h <= 0:
+            raise ValueError(f"retângulo {i + 1} sem largura ou altura em pixels: {list(boxes[i])}")
+    return boxes
+
+def render_chunk(jobs):
+    results = []
+    for job in jobs:
+        try:
+            size = image_header.image_dimensions(job["path"])
+            if not size:
+                raise ValueError(f"formato de imagem não reconhecido: {job['img']}")
+            width, height = size
+            boxes = pixel_boxes(job["boxes"], job["units"], width, height)
+            labels = job["labels"] + [f"Texto {i + 1}" for i in range(len(job["labels"]), len(boxes))]
+            html_contents = render.generate_html(
+                job["img"], (width, height), boxes, job["media_dir"], 1.0, job["timestamp"],
+                job["mode"], labels, job["text_position"], job["mask_style"]
+            )
+            results.append((job["line"], html_contents, job["extra"], job["tags"], None))
+        except Exception as e:
+            results.append((job["line"], None, None, None, f"{type(e).__name__}: {e}"))
+    return results
+
+def chunked(items, size):
+    chunk = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+def reference_assets(notetype):
+    changed = False
+    if CSS_IMPORT not in notetype["css"]:
+        notetype["css"] = f"{CSS_IMPORT}\n{notetype['css']}"
+        changed = True
+    for template in notetype["tmpls"]:
+        for key in ("qfmt", "afmt"):
+            if SCRIPT_TAG not in template[key]:
+                template[key] += SCRIPT_TAG
+                changed = True
+    return changed
+
+def ensure_notetype(col):
+    models = col.models
+    notetype = models.by_name(NOTETYPE_NAME)
+    if notetype:
+        if reference_assets(notetype):
+            models.update_dict(notetype)
+        return notetype
+    notetype = models.new(NOTETYPE_NAME)
+    for name in (IMAGE_FIELD, EXTRA_FIELD):
+        models.add_field(notetype, models.new_field(name))
+    template = models.new_template("Oclusão")
+    template["qfmt"] = "{{" + IMAGE_FIELD + "}}"
+    template["afmt"] = "{{" + IMAGE_FIELD + "}}<hr id=answer>{{" + EXTRA_FIELD + "}}"
+    models.add_template(notetype, template)
+    reference_assets(notetype)
+    models.add(notetype)
+    return models.by_name(NOTETYPE_NAME)
+
+class DeckWriter:
+    def __init__(self, col, deck_name):
+        from anki.collection import AddNoteRequest
+        self.request = AddNoteRequest
+        self.col = col
+        self.notetype = ensure_notetype(col)
+        self.deck_id = col.decks.id(deck_name)
+        self.pending = []
+        self.written = 0
+
+    def add(self, html_contents, extra, tags):
+        for html in html_contents:
+            note = self.col.new_note(self.notetype)
+            note[IMAGE_FIELD] = html
+            note[EXTRA_FIELD] = extra
+            note.tags = list(tags)
+            self.pending.append(self.request(note=note, deck_id=self.deck_id))
+        if len(self.pending) >= WRITE_BATCH:
+            self.flush()
+
+    def flush(self):
+        if self.pending:
+            self.col.add_notes(self.pending)
+            self.written += len(self.pending)
+            self.pending = []
+
+class Stats:
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.last_report = self.start
+        self.records = 0
+        self.errors = 0
+
+    def rate(self):
+        elapsed = time.perf_counter() - self.start
+        return self.records / elapsed if elapsed > 0 else 0.0
+
+    def report(self, writer, force=False):
+        now = time.perf_counter()
+        if force or now - self.last_report >= REPORT_EVERY:
+            self.last_report = now
+            print(f"{self.records} registros, {writer.written + len(writer.pending)} notas, "
+                  f"{self.errors} erros, {self.rate():.0f} registros/s", file=sys.stderr)
+
+def iter_jobs(manifest, col, stats):
+    base_dir = os.path.dirname(os.path.abspath(manifest))
+    media_dir = col.media.dir()
+    media_names = {}
+    timestamp = str(int(time.time()))
+    for line_no, raw in iter_manifest(manifest):
+        try:
+            if isinstance(raw, str):
+                raw = json.loads(raw)
+            record = normalize_record(raw, base_dir)
+            name = media_names.get(record["image"])
+            if name is None:
+                name = media_names[record["image"]] = col.media.add_file(record["image"])
+        except (OSError, ValueError, TypeError, AttributeError) as e:
+            stats.errors += 1
+            print(f"linha {line_no}: {e}", file=sys.stderr)
+            continue
+        record.update(line=line_no, img=name, path=os.path.join(media_dir, name), media_dir=media_dir, timestamp=timestamp)
+        yield record
+
+def collect(results, writer, stats):
+    for line_no, html_contents, extra, tags, error in results:
+        stats.records += 1
+        if error:
+            stats.errors += 1
+            print(f"linha {line_no}: {error}", file=sys.stderr)
+            continue
+        writer.add(html_contents, extra, tags)
+    stats.report(writer)
+
+def build_deck(col, manifest, deck_name, workers, chunk_size):
+    assets.ensure_media_assets(col)
+    writer = DeckWriter(col, deck_name)
+    stats = Stats()
+    in_flight = deque()
+    try:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            for chunk in chunked(iter_jobs(manifest, col, stats), chunk_size):
+                in_flight.append(pool.submit(render_chunk, chunk))
+                if len(in_flight) >= workers * 2:
+                    collect(in_flight.popleft().result(), writer, stats)
+            while in_flight:
+                collect(in_flight.popleft().result(), writer, stats)
+    finally:
+        writer.flush()
+    stats.report(writer, force=True)
+    return writer, stats
+
+def export_package(col, deck_id, out_path):
+    from anki.collection import DeckIdLimit, ExportAnkiPackageOptions
+    options = ExportAnkiPackageOptions(with_scheduling=False, with_deck_configs=False, with_media=True, legacy=True)
+    col.export_anki_package(out_path=os.path.abspath(out_path), options=options, limit=DeckIdLimit(deck_id))
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Gera cards de oclusão a partir de um manifesto JSONL/CSV (image, boxes, labels, mode) sem abrir o Anki."
+    )
+    parser.add_argument("manifest", help="arquivo .jsonl ou .csv, um registro por imagem")
+    parser.add_argument("--out", help="pacote .apkg a exportar")
+    parser.add_argument("--collection", help="coleção .anki2 onde gravar as notas (padrão: coleção temporária)")
+    parser.add_argument("--deck", default="Oclusão", help="nome do baralho de destino")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="processos de renderização")
+    parser.add_argument("--chunk", type=int, default=CHUNK_SIZE, help="registros por tarefa enviada aos processos")
+    args = parser.parse_args(argv)
+    if not args.out and not args.collection:
+        parser.error("informe --out e/ou --collection")
+
+    from anki.collection import Collection
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        col = Collection(args.collection or os.path.join(tmp_dir, "collection.anki2"))
+        try:
+            writer, stats = build_deck(col, args.manifest, args.deck, max(1, args.workers), max(1, args.chunk))
+            if args.out:
+                export_package(col, writer.deck_id, args.out)
+        finally:
+            col.close()
+    elapsed = time.perf_counter() - stats.start
+    print(f"{stats.records} registros em {elapsed:.1f}s ({stats.rate():.0f} registros/s), "
+          f"{writer.written} notas, {stats.errors} erros")
+    return 1 if stats.errors else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
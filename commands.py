@@ -0,0 +1,133 @@
+from collections import deque
+
+HISTORY_LIMIT = 1000
+
+class AddRect:
+    def __init__(self, rect, text):
+        self.rect = rect
+        self.text = text
+        self.index = None
+        self.mask_id = None
+
+    def redo(self, store):
+        if self.index is None:
+            self.index = store.add(*self.rect, self.text)
+            self.mask_id = store.ids[self.index]
+        else:
+            store.insert(self.index, *self.rect, self.text, self.mask_id)
+
+    def undo(self, store):
+        store.remove([self.index])
+
+class RemoveRects:
+    def __init__(self, store, indices):
+        self.entries = [(index, store.rect(index), store.texts[index], store.ids[index]) for index in sorted(indices)]
+
+    def redo(self, store):
+        store.remove([index for index, *_ in self.entries])
+
+    def undo(self, store):
+        for index, rect, text, mask_id in self.entries:
+            store.insert(index, *rect, text, mask_id)
+
+class MoveRects:
+    def __init__(self, indices, dx, dy, merge_key=None):
+        self.indices = tuple(sorted(indices))
+        self.dx = dx
+        self.dy = dy
+        self.merge_key = merge_key
+
+    def redo(self, store):
+        for index in self.indices:
+            store.move(index, self.dx, self.dy)
+
+    def undo(self, store):
+        for index in self.indices:
+            store.move(index, -self.dx, -self.dy)
+
+    def merge(self, other):
+        if not isinstance(other, MoveRects) or other.indices != self.indices:
+            return False
+        self.dx += other.dx
+        self.dy += other.dy
+        return True
+
+class SetRect:
+    def __init__(self, index, old_rect, new_rect, merge_key=None):
+        self.index = index
+        self.old_rect = old_rect
+        self.new_rect = new_rect
+        self.merge_key = merge_key
+
+    def redo(self, store):
+        store.set_rect(self.index, *self.new_rect)
+
+    def undo(self, store):
+        store.set_rect(self.index, *self.old_rect)
+
+    def merge(self, other):
+        if not isinstance(other, SetRect) or other.index != self.index:
+            return False
+        self.new_rect = other.new_rect
+        return True
+
+class Relabel:
+    def __init__(self, index, old_text, new_text):
+        self.index = index
+        self.old_text = old_text
+        self.new_text = new_text
+
+    def redo(self, store):
+        store.texts[self.index] = self.new_text
+
+    def undo(self, store):
+        store.texts[self.index] = self.old_text
+
+class UndoStack:
+    def __init__(self, limit=HISTORY_LIMIT):
+        self.done = deque(maxlen=limit)
+        self.undone = []
+
+    def execute(self, command, store):
+        command.redo(store)
+        self.undone.clear()
+        key = getattr(command, "merge_key", None)
+        if key is not None and self.done:
+            top = self.done[-1]
+            if getattr(top, "merge_key", None) == key and top.merge(command):
+                return
+        self.done.append(command)
+
+    def undo(self, store):
+        if not self.done:
+            return None
+        command = self.done.pop()
+        command.undo(store)
+        self.undone.append(command)
+        return command
+
+    def redo(self, store):
+        if not self.undone:
+            return None
+        command = self.undone.pop()
+        command.redo(store)
+        self.done.append(command)
+        return command
+
+    def can_undo(self):
+        return bool(self.done)
+
+    def can_redo(self):
+        return bool(self.undone)
+
+class CommandGroup:
+    def __init__(self, commands):
+        self.commands = list(commands)
+
+    def redo(self, store):
+        for command in self.commands:
+            command.redo(store)
+
+    def undo(self, store):
+        for command in reversed(self.commands):
+            command.undo(store)
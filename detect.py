@@ -0,0 +1,137 @@
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+WORK_WIDTH = 1600
+THRESHOLD_WINDOW = 31
+THRESHOLD_OFFSET = 12
+MIN_HEIGHT = 5
+MAX_HEIGHT_FRACTION = 0.12
+MAX_WIDTH_FRACTION = 0.6
+MIN_DENSITY = 0.08
+MAX_DENSITY = 0.85
+PADDING = 3
+
+def available():
+    return np is not None
+
+def gray_array(image):
+    from aqt.qt import QImage
+    gray = image.convertToFormat(QImage.Format.Format_Grayscale8)
+    ptr = gray.constBits()
+    ptr.setsize(gray.sizeInBytes())
+    rows = np.frombuffer(ptr, np.uint8).reshape(gray.height(), gray.bytesPerLine())
+    return rows[:, :gray.width()].copy()
+
+def downscale(gray, factor):
+    if factor == 1:
+        return gray
+    h = gray.shape[0] // factor * factor
+    w = gray.shape[1] // factor * factor
+    return gray[:h, :w].reshape(h // factor, factor, w // factor, factor).mean(axis=(1, 3))
+
+def box_sum(values, kh, kw):
+    integral = np.zeros((values.shape[0] + 1, values.shape[1] + 1), np.int64 if values.dtype == np.bool_ else np.float64)
+    np.cumsum(np.cumsum(values, axis=0), axis=1, out=integral[1:, 1:])
+    h, w = values.shape
+    top = np.clip(np.arange(h) - kh // 2, 0, h)
+    bottom = np.clip(np.arange(h) + kh // 2 + 1, 0, h)
+    left = np.clip(np.arange(w) - kw // 2, 0, w)
+    right = np.clip(np.arange(w) + kw // 2 + 1, 0, w)
+    return (integral[bottom][:, right] - integral[top][:, right]
+            - integral[bottom][:, left] + integral[top][:, left])
+
+def adaptive_threshold(gray, window, offset):
+    h, w = gray.shape
+    rows = np.clip(np.arange(h) + window // 2 + 1, 0, h) - np.clip(np.arange(h) - window // 2, 0, h)
+    cols = np.clip(np.arange(w) + window // 2 + 1, 0, w) - np.clip(np.arange(w) - window // 2, 0, w)
+    mean = box_sum(gray.astype(np.float64), window, window) / np.outer(rows, cols)
+    dark = gray < mean - offset
+    light = gray > mean + offset
+    return dark if dark.sum() <= light.sum() * 4 else light
+
+def dilate(mask, kh, kw):
+    return box_sum(mask, kh, kw) > 0
+
+def label_runs(mask):
+    padded = np.zeros((mask.shape[0], mask.shape[1] + 2), np.int8)
+    padded[:, 1:-1] = mask
+    edges = np.diff(padded, axis=1)
+    run_rows, run_starts = np.nonzero(edges == 1)
+    _, run_ends = np.nonzero(edges == -1)
+    count = len(run_rows)
+    parent = list(range(count))
+
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    row_first = np.searchsorted(run_rows, np.arange(mask.shape[0] + 1))
+    for row in range(1, mask.shape[0]):
+        a, a_end = row_first[row - 1], row_first[row]
+        b, b_end = row_first[row], row_first[row + 1]
+        while a < a_end and b < b_end:
+            if run_starts[a] < run_ends[b] and run_starts[b] < run_ends[a]:
+                ra, rb = find(a), find(b)
+                if ra != rb:
+                    parent[max(ra, rb)] = min(ra, rb)
+            if run_ends[a] < run_ends[b]:
+                a += 1
+            else:
+                b += 1
+    roots = np.fromiter((find(i) for i in range(count)), np.int64, count)
+    return run_rows, run_starts, run_ends, roots
+
+def component_boxes(mask):
+    run_rows, run_starts, run_ends, roots = label_runs(mask)
+    if not len(roots):
+        return np.zeros((0, 4), np.int64)
+    labels, inverse = np.unique(roots, return_inverse=True)
+    n = len(labels)
+    x0 = np.full(n, np.iinfo(np.int64).max)
+    y0 = np.full(n, np.iinfo(np.int64).max)
+    x1 = np.zeros(n, np.int64)
+    y1 = np.zeros(n, np.int64)
+    np.minimum.at(x0, inverse, run_starts)
+    np.minimum.at(y0, inverse, run_rows)
+    np.maximum.at(x1, inverse, run_ends)
+    np.maximum.at(y1, inverse, run_rows + 1)
+    return np.stack([x0, y0, x1 - x0, y1 - y0], axis=1)
+
+def detect_text_regions(gray):
+    height, width = gray.shape
+    factor = max(1, int(np.ceil(width / WORK_WIDTH)))
+    small = downscale(gray, factor)
+    ink = adaptive_threshold(small, THRESHOLD_WINDOW, THRESHOLD_OFFSET)
+    char_height = max(2, small.shape[0] // 150)
+    kh, kw = max(1, char_height // 2) * 2 + 1, char_height * 2 + 1
+    boxes = component_boxes(dilate(ink, kh, kw))
+    if not len(boxes):
+        return []
+    shrink = np.array([kw // 2, kh // 2, -2 * (kw // 2), -2 * (kh // 2)])
+    boxes = boxes + shrink
+    boxes[:, 0] = np.clip(boxes[:, 0], 0, small.shape[1] - 1)
+    boxes[:, 1] = np.clip(boxes[:, 1], 0, small.shape[0] - 1)
+    boxes[:, 2] = np.clip(boxes[:, 2], 1, small.shape[1] - boxes[:, 0])
+    boxes[:, 3] = np.clip(boxes[:, 3], 1, small.shape[0] - boxes[:, 1])
+    integral = np.zeros((ink.shape[0] + 1, ink.shape[1] + 1), np.int64)
+    np.cumsum(np.cumsum(ink, axis=0), axis=1, out=integral[1:, 1:])
+    x, y, w, h = boxes.T
+    density = (integral[y + h, x + w] - integral[y, x + w] - integral[y + h, x] + integral[y, x]) / (w * h)
+    keep = (
+        (h >= MIN_HEIGHT / factor) & (h <= small.shape[0] * MAX_HEIGHT_FRACTION)
+        & (w <= small.shape[1] * MAX_WIDTH_FRACTION) & (w >= h * 0.8)
+        & (density >= MIN_DENSITY) & (density <= MAX_DENSITY)
+    )
+    regions = []
+    for bx, by, bw, bh in boxes[keep]:
+        left = max(0, int(bx) * factor - PADDING)
+        top = max(0, int(by) * factor - PADDING)
+        right = min(width, int(bx + bw) * factor + PADDING)
+        bottom = min(height, int(by + bh) * factor + PADDING)
+        regions.append((left, top, right - left, bottom - top))
+    regions.sort(key=lambda r: (r[1] // max(1, r[3]), r[0]))
+    return regions
@@ -0,0 +1,146 @@
+import os
+from aqt.qt import QBuffer, QByteArray, QIODevice, QImage, QImageWriter, Qt
+from .imaging import decode_image
+from .tracing import span
+
+FORMAT_EXTENSIONS = {"PNG": ".png", "JPEG": ".jpg", "WEBP": ".webp"}
+LOSSY_SOURCES = {".jpg", ".jpeg", ".webp"}
+DEFAULT_SETTINGS = {
+    "format": "auto",
+    "max_dimension": 4096,
+    "max_bytes": 1536000,
+    "jpeg_quality": 85,
+    "webp_quality": 80,
+    "min_quality": 50,
+    "reencode_oversized": False,
+}
+QUALITY_STEP = 10
+PHOTO_SAMPLE = 64
+PHOTO_COLORS = 1024
+
+def encoding_settings(config):
+    settings = dict(DEFAULT_SETTINGS)
+    settings.update((config or {}).get("image_encoding", {}))
+    return settings
+
+def webp_supported():
+    return any(bytes(fmt).lower() == b"webp" for fmt in QImageWriter.supportedImageFormats())
+
+def encode(image, fmt, quality=-1):
+    data = QByteArray()
+    buffer = QBuffer(data)
+    buffer.open(QIODevice.OpenModeFlag.WriteOnly)
+    ok = image.save(buffer, fmt, quality)
+    buffer.close()
+    return bytes(data) if ok else None
+
+def image_bytes(image):
+    ptr = image.constBits()
+    ptr.setsize(image.sizeInBytes())
+    return bytes(ptr)
+
+def has_transparency(image):
+    if not image.hasAlphaChannel():
+        return False
+    alpha = image.convertToFormat(QImage.Format.Format_Alpha8)
+    data = image_bytes(alpha)
+    stride, width = alpha.bytesPerLine(), alpha.width()
+    return any(min(data[row * stride:row * stride + width]) < 255 for row in range(alpha.height()))
+
+def is_photo(image):
+    sample = image.scaled(PHOTO_SAMPLE, PHOTO_SAMPLE, Qt.AspectRatioMode.IgnoreAspectRatio, Qt.TransformationMode.FastTransformation)
+    data = image_bytes(sample.convertToFormat(QImage.Format.Format_RGB32))
+    return len({data[i:i + 4] for i in range(0, len(data), 4)}) > PHOTO_COLORS
+
+def format_options(image, source_ext, settings):
+    webp = webp_supported()
+    transparent = has_transparency(image)
+    lossless = [("PNG", -1)]
+    lossy = []
+    if webp:
+        lossless.append(("WEBP", 100))
+        lossy.append(("WEBP", settings["webp_quality"]))
+    if not transparent:
+        lossy.insert(0, ("JPEG", settings["jpeg_quality"]))
+    choice = settings["format"].lower()
+    if choice == "png":
+        return [("PNG", -1)], [], False
+    if choice == "webp_lossless" and webp:
+        return [("WEBP", 100)], [], False
+    if choice == "webp" and webp:
+        return [], [("WEBP", settings["webp_quality"])], True
+    if choice == "jpeg" and not transparent:
+        return [], [("JPEG", settings["jpeg_quality"])], True
+    return lossless, lossy, source_ext in LOSSY_SOURCES or is_photo(image)
+
+def encode_best(image, source_ext, settings):
+    lossless, lossy, prefer_lossy = format_options(image, source_ext, settings)
+    budget = settings["max_bytes"]
+    best = None
+    for fmt, quality in (lossy if prefer_lossy and lossy else lossless):
+        data = encode(image, fmt, quality)
+        if data is not None and (best is None or len(data) < len(best[2])):
+            best = (fmt, quality, data)
+    if best is not None and len(best[2]) <= budget:
+        return best
+    for fmt, quality in lossy:
+        while True:
+            data = encode(image, fmt, quality)
+            if data is not None and (best is None or len(data) < len(best[2])):
+                best = (fmt, quality, data)
+            if (data is not None and len(data) <= budget) or quality - QUALITY_STEP < settings["min_quality"]:
+                break
+            quality -= QUALITY_STEP
+        if best is not None and len(best[2]) <= budget:
+            break
+    return best
+
+def claim_target(stem, ext, full_path):
+    target = stem + ext
+    if target == full_path:
+        return target
+    index = 1
+    while True:
+        try:
+            os.close(os.open(target, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+            return target
+        except FileExistsError:
+            target = f"{stem}-{index}{ext}"
+            index += 1
+
+def needs_reencode(full_path, size, settings):
+    if not settings["reencode_oversized"]:
+        return False
+    try:
+        too_big = os.path.getsize(full_path) > settings["max_bytes"]
+    except OSError:
+        return False
+    return too_big or max(size.width(), size.height()) > settings["max_dimension"]
+
+def reencode(full_path, settings=DEFAULT_SETTINGS):
+    stem, source_ext = os.path.splitext(full_path)
+    source_ext = source_ext.lower()
+    before = os.path.getsize(full_path)
+    image = decode_image(full_path)
+    if image.isNull():
+        raise ValueError(f"Imagem ilegível: {full_path}")
+    limit = settings["max_dimension"]
+    scaled = max(image.width(), image.height()) > limit
+    if scaled:
+        image = image.scaled(limit, limit, Qt.AspectRatioMode.KeepAspectRatio, Qt.TransformationMode.SmoothTransformation)
+    with span("save.encode", source=source_ext):
+        best = encode_best(image, source_ext, settings)
+    if best is None:
+        raise ValueError(f"Nenhum formato conseguiu codificar {full_path}")
+    fmt, quality, data = best
+    if not scaled and len(data) >= before:
+        return None
+    target = claim_target(stem, FORMAT_EXTENSIONS[fmt], full_path)
+    tmp_path = target + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+    os.replace(tmp_path, target)
+    return {
+        "path": target, "format": fmt, "quality": quality,
+        "before": before, "after": len(data), "width": image.width(), "height": image.height(),
+    }
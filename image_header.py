@@ -0,0 +1,86 @@
+import struct
+
+JPEG_SOF_MARKERS = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+EXIF_ORIENTATION = 0x0112
+ROTATED_ORIENTATIONS = {5, 6, 7, 8}
+
+def exif_orientation(segment):
+    if not segment.startswith(b"Exif\0\0") or len(segment) < 14:
+        return 1
+    tiff = segment[6:]
+    endian = "<" if tiff[:2] == b"II" else ">"
+    offset = struct.unpack(endian + "I", tiff[4:8])[0]
+    if offset + 2 > len(tiff):
+        return 1
+    count = struct.unpack(endian + "H", tiff[offset:offset + 2])[0]
+    for i in range(count):
+        entry = offset + 2 + i * 12
+        if entry + 12 > len(tiff):
+            break
+        tag, _, _ = struct.unpack(endian + "HHI", tiff[entry:entry + 8])
+        if tag == EXIF_ORIENTATION:
+            return struct.unpack(endian + "H", tiff[entry + 8:entry + 10])[0]
+    return 1
+
+def jpeg_size(f):
+    f.seek(2)
+    orientation = 1
+    while True:
+        byte = f.read(1)
+        while byte and byte != b"\xff":
+            byte = f.read(1)
+        while byte == b"\xff":
+            byte = f.read(1)
+        if not byte:
+            return None
+        marker = byte[0]
+        if marker in (0xD8, 0x01) or 0xD0 <= marker <= 0xD7:
+            continue
+        length = struct.unpack(">H", f.read(2))[0]
+        if length < 2:
+            return None
+        if marker in JPEG_SOF_MARKERS:
+            height, width = struct.unpack(">xHH", f.read(5))
+            return (height, width) if orientation in ROTATED_ORIENTATIONS else (width, height)
+        segment = f.read(length - 2)
+        if marker == 0xE1:
+            orientation = exif_orientation(segment)
+
+def webp_size(head):
+    if len(head) < 30:
+        return None
+    chunk = head[12:16]
+    if chunk == b"VP8 ":
+        width, height = struct.unpack("<HH", head[26:30])
+        return width & 0x3FFF, height & 0x3FFF
+    if chunk == b"VP8L":
+        bits = struct.unpack("<I", head[21:25])[0]
+        return (bits & 0x3FFF) + 1, ((bits >> 14) & 0x3FFF) + 1
+    if chunk == b"VP8X":
+        return int.from_bytes(head[24:27], "little") + 1, int.from_bytes(head[27:30], "little") + 1
+    return None
+
+def read_dimensions(f):
+    head = f.read(32)
+    if head.startswith(b"\x89PNG\r\n\x1a\n"):
+        return struct.unpack(">II", head[16:24])
+    if head[:6] in (b"GIF87a", b"GIF89a"):
+        return struct.unpack("<HH", head[6:10])
+    if head.startswith(b"\xff\xd8"):
+        return jpeg_size(f)
+    if head.startswith(b"RIFF") and head[8:12] == b"WEBP":
+        return webp_size(head)
+    if head.startswith(b"BM"):
+        width, height = struct.unpack("<ii", head[18:26])
+        return width, abs(height)
+    return None
+
+def image_dimensions(path):
+    with open(path, "rb") as f:
+        try:
+            size = read_dimensions(f)
+        except struct.error:
+            return None
+    if size is None or size[0] <= 0 or size[1] <= 0:
+        return None
+    return size
@@ -0,0 +1,35 @@
+from aqt.qt import QImageReader, QImageIOHandler, Qt
+from .tracing import span, traced
+
+ALLOCATION_LIMIT_MB = 1024
+
+def raise_allocation_limit():
+    if not hasattr(QImageReader, "setAllocationLimit"):
+        return
+    current = QImageReader.allocationLimit()
+    if 0 < current < ALLOCATION_LIMIT_MB:
+        QImageReader.setAllocationLimit(ALLOCATION_LIMIT_MB)
+
+def image_reader(full_path):
+    reader = QImageReader(full_path)
+    reader.setAutoTransform(True)
+    return reader
+
+@traced("image.read_size")
+def read_image_size(full_path):
+    reader = image_reader(full_path)
+    size = reader.size()
+    if reader.transformation() & QImageIOHandler.Transformation.TransformationRotate90:
+        size = size.transposed()
+    return size
+
+def decode_image(full_path, max_size=None):
+    with span("image.decode", scaled=max_size is not None):
+        reader = image_reader(full_path)
+        if max_size is not None:
+            size = reader.size()
+            if size.isValid() and (size.width() > max_size.width() or size.height() > max_size.height()):
+                reader.setScaledSize(size.scaled(max_size, Qt.AspectRatioMode.KeepAspectRatio))
+        return reader.read()
+
+raise_allocation_limit()
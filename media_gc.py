@@ -0,0 +1,162 @@
+import os
+import re
+import json
+import html
+from urllib.parse import unquote
+from aqt import mw
+from aqt.qt import QAction, qconnect
+from aqt.operations import QueryOp
+from aqt.utils import askUser, showInfo, tooltip
+from anki.utils import ids2str
+from .batch import report_progress
+from .media_store import encode_outputs
+
+CACHE_FILENAME = "oclusao_media_gc.json"
+REFERENCE_PATTERN = re.compile(r"""(?:src|href)\s*=\s*["']([^"']+)["']|\[sound:([^\]]+)\]|url\(\s*["']?([^"')]+)""", re.IGNORECASE)
+FETCH_BATCH = 500
+PREVIEW_LINES = 20
+
+def field_references(flds):
+    refs = set()
+    for match in REFERENCE_PATTERN.finditer(flds):
+        value = next(group for group in match.groups() if group)
+        name = unquote(html.unescape(value.split("?")[0])).strip()
+        if name and "://" not in name:
+            refs.add(name)
+    return refs
+
+def template_references(col):
+    refs = set()
+    for notetype in col.models.all():
+        refs.update(field_references(notetype.get("css", "")))
+        for template in notetype.get("tmpls", []):
+            refs.update(field_references(template.get("qfmt", "") + template.get("afmt", "")))
+    return refs
+
+def find_orphans(media_dir, referenced, outputs=None):
+    orphans = []
+    sizes = {}
+    with os.scandir(media_dir) as entries:
+        for entry in entries:
+            if not entry.is_file():
+                continue
+            name = entry.name
+            sizes[name] = entry.stat().st_size
+            stem, ext = os.path.splitext(name)
+            ext = ext.lower()
+            if ext == ".backup":
+                kind = "backup"
+            elif ext == ".png" and stem.endswith("_original"):
+                kind = "original"
+            else:
+                continue
+            if name not in referenced:
+                orphans.append([name, kind, sizes[name]])
+    superseded = {source for output, source in (outputs or {}).items()
+                  if output in referenced and source in sizes and source not in referenced}
+    orphans.extend([name, "superseded", sizes[name]] for name in superseded)
+    orphans.sort(key=lambda orphan: -orphan[2])
+    return orphans
+
+class MediaIndex:
+    def __init__(self, path):
+        self.path = path
+        self.notes = {}
+        self.media_mtime_ns = None
+        self.orphans = None
+        try:
+            with open(path, encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return
+        self.notes = data.get("notes", {})
+        self.media_mtime_ns = data.get("media_mtime_ns")
+        self.orphans = data.get("orphans")
+
+    def save(self):
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"version": 1, "notes": self.notes, "media_mtime_ns": self.media_mtime_ns, "orphans": self.orphans},
+                      f, ensure_ascii=False, separators=(",", ":"))
+        os.replace(tmp_path, self.path)
+
+    def update_references(self, col):
+        current = {str(nid): mod for nid, mod in col.db.all("select id, mod from notes")}
+        removed = [key for key in self.notes if key not in current]
+        for key in removed:
+            del self.notes[key]
+        stale = [int(key) for key, mod in current.items() if key not in self.notes or self.notes[key][0] != mod]
+        for start in range(0, len(stale), FETCH_BATCH):
+            report_progress(f"Indexando referências {start}/{len(stale)}", start, len(stale))
+            for nid, mod, flds in col.db.all("select id, mod, flds from notes where id in " + ids2str(stale[start:start + FETCH_BATCH])):
+                self.notes[str(nid)] = [mod, sorted(field_references(flds))]
+        return bool(removed or stale)
+
+    def referenced(self):
+        refs = set()
+        for _, note_refs in self.notes.values():
+            refs.update(note_refs)
+        return refs
+
+def scan_orphans(col):
+    media_dir = col.media.dir()
+    index = MediaIndex(os.path.join(os.path.dirname(os.path.normpath(media_dir)), CACHE_FILENAME))
+    changed = index.update_references(col)
+    templates = template_references(col)
+    media_mtime_ns = os.stat(media_dir).st_mtime_ns
+    if changed or index.orphans is None or index.media_mtime_ns != media_mtime_ns:
+        report_progress("Procurando arquivos órfãos...", 0, 0)
+        index.orphans = find_orphans(media_dir, index.referenced() | templates, encode_outputs(media_dir))
+        index.media_mtime_ns = media_mtime_ns
+        index.save()
+    return [orphan for orphan in index.orphans if orphan[0] not in templates]
+
+def format_size(num_bytes):
+    for unit in ("B", "KB", "MB"):
+        if num_bytes < 1024:
+            return f"{num_bytes:.0f} {unit}" if unit == "B" else f"{num_bytes:.1f} {unit}"
+        num_bytes /= 1024
+    return f"{num_bytes:.2f} GB"
+
+def orphan_report(orphans):
+    total = sum(size for _, _, size in orphans)
+    kinds = {}
+    for _, kind, size in orphans:
+        count, kind_total = kinds.get(kind, (0, 0))
+        kinds[kind] = (count + 1, kind_total + size)
+    labels = {"backup": "cópias .backup", "original": "arquivos _original.png", "superseded": "imagens substituídas"}
+    lines = [f"{len(orphans)} arquivos sem referência em nenhuma nota ({format_size(total)}):"]
+    for kind, (count, kind_total) in kinds.items():
+        lines.append(f"  {labels[kind]}: {count} ({format_size(kind_total)})")
+    lines.append("")
+    lines.extend(f"{name} ({format_size(size)})" for name, _, size in orphans[:PREVIEW_LINES])
+    if len(orphans) > PREVIEW_LINES:
+        lines.append(f"... e mais {len(orphans) - PREVIEW_LINES}")
+    lines.append("")
+    lines.append("Mover estes arquivos para a lixeira de mídia do Anki?")
+    return "\n".join(lines)
+
+def trash_orphans(col, names):
+    col.media.trash_files(names)
+    return len(names)
+
+def collect_garbage():
+    def on_scanned(orphans):
+        if not orphans:
+            showInfo("Nenhuma mídia órfã da oclusão encontrada.")
+            return
+        if not askUser(orphan_report(orphans)):
+            return
+        names = [name for name, _, _ in orphans]
+        QueryOp(
+            parent=mw,
+            op=lambda col: trash_orphans(col, names),
+            success=lambda count: tooltip(f"{count} arquivos movidos para a lixeira de mídia.")
+        ).with_progress("Removendo mídia órfã...").run_in_background()
+
+    QueryOp(parent=mw, op=scan_orphans, success=on_scanned).with_progress("Procurando mídia órfã...").run_in_background()
+
+def setup_gc_action():
+    action = QAction("Oclusão: limpar mídia órfã...", mw)
+    qconnect(action.triggered, collect_garbage)
+    mw.form.menuTools.addAction(action)
@@ -0,0 +1,146 @@
+import os
+import json
+import shutil
+import hashlib
+import threading
+from .tracing import traced
+
+STORE_DIRNAME = "oclusao_originals"
+INDEX_FILENAME = "index.json"
+HASH_CHUNK = 1024 * 1024
+FICLONE = 0x40049409
+
+_lock = threading.Lock()
+_stores = {}
+
+def file_hash(path):
+    digest = hashlib.blake2b(digest_size=20)
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def reflink(source, target):
+    import fcntl
+    with open(source, "rb") as src, open(target, "wb") as dst:
+        try:
+            fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+        except OSError:
+            dst.close()
+            os.remove(target)
+            raise
+
+def link_or_copy(source, target):
+    try:
+        reflink(source, target)
+        return "reflink"
+    except (OSError, ImportError):
+        pass
+    try:
+        os.link(source, target)
+        return "hardlink"
+    except OSError:
+        pass
+    shutil.copyfile(source, target)
+    return "copy"
+
+class OriginalStore:
+    def __init__(self, root):
+        self.root = root
+        self.index_path = os.path.join(root, INDEX_FILENAME)
+        self.objects = {}
+        self.files = {}
+        self.originals = {}
+        self.outputs = {}
+        self.load()
+
+    def load(self):
+        try:
+            with open(self.index_path, encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return
+        self.objects = data.get("objects", {})
+        self.files = data.get("files", {})
+        self.originals = data.get("originals", {})
+        self.outputs = data.get("outputs", {})
+
+    def save(self):
+        os.makedirs(self.root, exist_ok=True)
+        tmp_path = self.index_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"version": 1, "objects": self.objects, "files": self.files, "originals": self.originals,
+                       "outputs": self.outputs}, f, separators=(",", ":"))
+        os.replace(tmp_path, self.index_path)
+
+    def known_hash(self, media_path):
+        entry = self.files.get(os.path.basename(media_path))
+        if not entry:
+            return None
+        st = os.stat(media_path)
+        size, mtime_ns, digest = entry
+        if size == st.st_size and mtime_ns == st.st_mtime_ns:
+            return digest
+        return None
+
+    def object_path(self, digest):
+        name = self.objects.get(digest)
+        return os.path.join(self.root, name) if name else None
+
+    def add(self, media_path):
+        filename = os.path.basename(media_path)
+        digest = self.known_hash(media_path)
+        if digest is None:
+            digest = file_hash(media_path)
+        changed = False
+        stored = self.object_path(digest)
+        if stored is None or not os.path.exists(stored):
+            os.makedirs(self.root, exist_ok=True)
+            name = digest + os.path.splitext(filename)[1].lower()
+            stored = os.path.join(self.root, name)
+            if not os.path.exists(stored):
+                link_or_copy(media_path, stored)
+            self.objects[digest] = name
+            changed = True
+        st = os.stat(media_path)
+        entry = [st.st_size, st.st_mtime_ns, digest]
+        if self.files.get(filename) != entry:
+            self.files[filename] = entry
+            changed = True
+        if filename not in self.originals:
+            self.originals[filename] = digest
+            changed = True
+        if changed:
+            self.save()
+        return digest
+
+    def original_for(self, filename):
+        digest = self.originals.get(filename)
+        return self.object_path(digest) if digest else None
+
+def store_for(media_dir):
+    root = os.path.join(os.path.dirname(os.path.normpath(media_dir)), STORE_DIRNAME)
+    store = _stores.get(root)
+    if store is None:
+        store = _stores[root] = OriginalStore(root)
+    return store
+
+@traced("original.store")
+def store_original(media_dir, media_path):
+    with _lock:
+        return store_for(media_dir).add(media_path)
+
+def record_output(media_dir, output_name, source_name):
+    with _lock:
+        store = store_for(media_dir)
+        if store.outputs.get(output_name) != source_name:
+            store.outputs[output_name] = source_name
+            store.save()
+
+def encode_outputs(media_dir):
+    with _lock:
+        return dict(store_for(media_dir).outputs)
+
+def original_path(media_dir, filename):
+    with _lock:
+        return store_for(media_dir).original_for(filename)
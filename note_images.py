@@ -0,0 +1,112 @@
+import re
+import html
+from .assets import ASSET_TAGS
+from .occlusion_data import read_model
+
+CONTAINER_PATTERN = re.compile(
+    r'<div class="anki-(?:container|multiple-card)"[^>]*data-oclusao="[^"]*".*?' + re.escape(ASSET_TAGS), re.DOTALL
+)
+IMG_TAG_PATTERN = re.compile(r'<img[^>]+src=["\'](.*?)["\'][^>]*>')
+DIV_MASK_PATTERN = re.compile(
+    r'class="anki-rect(?:-multi)?" id="rect\d+" data-correct-text="([^"]*)"\s*'
+    r'style="[^"]*?left:\s*([-\d.eE+]+)%;\s*top:\s*([-\d.eE+]+)%;\s*width:\s*([-\d.eE+]+)%;\s*height:\s*([-\d.eE+]+)%'
+)
+SVG_LAYER_PATTERN = re.compile(r'class="anki-mask-layer" viewBox="0 0 (\d+) (\d+)"')
+SVG_MASK_PATTERN = re.compile(
+    r'<rect class="anki-mask" id="rect\d+" data-correct-text="([^"]*)" x="(-?\d+)" y="(-?\d+)" width="(\d+)" height="(\d+)"/>'
+)
+LEGACY_TEXT_PATTERN = re.compile(r'<div class="anki-text" id="text\d+"[^>]*>(.*?)</div>', re.DOTALL)
+TEXT_POSITION_MARKERS = (("margin-bottom", "top"), ("margin-top", "bottom"), ("margin-right", "left"), ("margin-left", "right"))
+
+def parse_stored_masks(content):
+    svg_layer = SVG_LAYER_PATTERN.search(content)
+    if svg_layer:
+        width, height = int(svg_layer.group(1)), int(svg_layer.group(2))
+        masks = SVG_MASK_PATTERN.findall(content)
+        rects = [[int(x) / width, int(y) / height, int(w) / width, int(h) / height] for _, x, y, w, h in masks]
+        mask_style = "svg"
+    else:
+        masks = DIV_MASK_PATTERN.findall(content)
+        rects = [[float(v) / 100 for v in mask[1:]] for mask in masks]
+        mask_style = "div"
+    if not masks:
+        return None
+    text_position = "top"
+    bank = content.find('class="anki-text-container"')
+    if bank != -1:
+        style = content[bank:content.find(">", bank)]
+        for marker, position in TEXT_POSITION_MARKERS:
+            if marker in style:
+                text_position = position
+                break
+    texts = [html.unescape(mask[0]) for mask in masks]
+    card_option = "multiple" if "anki-multiple-card" in content else "single"
+    if card_option == "multiple":
+        distractors = [html.unescape(text) for text in LEGACY_TEXT_PATTERN.findall(content)]
+        for text in texts:
+            if text in distractors:
+                distractors.remove(text)
+        texts += distractors
+    return {
+        "rects": rects,
+        "texts": texts,
+        "card_option": card_option,
+        "text_position": text_position,
+        "mask_style": mask_style,
+    }
+
+class ImageSlot:
+    def __init__(self, field, img_path, stored=None, span=None):
+        self.field = field
+        self.img_path = img_path
+        self.stored = stored
+        self.span = span
+        self.full_path = None
+        self.original_size = None
+        self.area = None
+        self.original_error = None
+
+def find_note_images(note):
+    slots = []
+    for field in note.keys():
+        content = note[field]
+        containers = [(match.span(), read_model(match.group(0))) for match in CONTAINER_PATTERN.finditer(content)]
+        containers = [(span, model) for span, model in containers if model]
+        model = None if containers else read_model(content)
+        if model:
+            slots.append(ImageSlot(field, model["img"], model))
+            continue
+        images = []
+        for match in IMG_TAG_PATTERN.finditer(content):
+            if not any(start <= match.start() < end for (start, end), _ in containers):
+                images.append(match)
+        if not containers and len(images) == 1:
+            masks = parse_stored_masks(content)
+            if masks:
+                slots.append(ImageSlot(field, images[0].group(1).split('?')[0], masks))
+                continue
+        entries = [(span[0], ImageSlot(field, model["img"], model, span)) for span, model in containers]
+        entries += [(match.start(), ImageSlot(field, match.group(1).split('?')[0], None, match.span())) for match in images]
+        slots.extend(slot for _, slot in sorted(entries, key=lambda entry: entry[0]))
+    return slots
+
+def replace_images(fields, replacements):
+    fields = dict(fields)
+    by_field = {}
+    for slot, markup in replacements:
+        by_field.setdefault(slot.field, []).append((slot.span, markup))
+    for field, items in by_field.items():
+        content = fields[field]
+        for span, markup in sorted(items, key=lambda item: item[0][0] if item[0] else 0, reverse=True):
+            if span is None:
+                content = markup
+            else:
+                content = content[:span[0]] + markup.strip() + content[span[1]:]
+        fields[field] = content
+    return fields
+
+def card_fields(original, replacements, slot, card_html):
+    items = [(other, card_html if other is slot else markup) for other, markup in replacements]
+    if not any(other is slot for other, _ in replacements):
+        items.append((slot, card_html))
+    return replace_images(original, items)
@@ -0,0 +1,89 @@
+import re
+import json
+import html
+import secrets
+
+MODEL_VERSION = 1
+DATA_ATTRIBUTE = "data-oclusao"
+DATA_PATTERN = re.compile(DATA_ATTRIBUTE + r'="([^"]*)"')
+COORD_DIGITS = 5
+
+def as_box(rect):
+    if hasattr(rect, "left"):
+        return rect.left(), rect.top(), rect.width(), rect.height()
+    x, y, w, h = rect
+    return x, y, w, h
+
+def as_size(size):
+    if hasattr(size, "width"):
+        return size.width(), size.height()
+    width, height = size
+    return width, height
+
+def build_model(img_filename, width, height, rectangles, texts, card_option, text_position, mask_style, ids=None):
+    boxes = [as_box(rect) for rect in rectangles]
+    model = {
+        "v": MODEL_VERSION,
+        "img": img_filename,
+        "w": width,
+        "h": height,
+        "rects": [
+            [round(x / width, COORD_DIGITS), round(y / height, COORD_DIGITS),
+             round(w / width, COORD_DIGITS), round(h / height, COORD_DIGITS)]
+            for x, y, w, h in boxes
+        ],
+        "texts": list(texts),
+        "card_option": card_option,
+        "text_position": text_position,
+        "mask_style": mask_style,
+    }
+    if ids is not None:
+        model["ids"] = list(ids)
+    return model
+
+def encode_model(model):
+    return html.escape(json.dumps(model, ensure_ascii=False, separators=(",", ":")), quote=True)
+
+def data_attribute(model):
+    return f'{DATA_ATTRIBUTE}="{encode_model(model)}"'
+
+def new_set_id():
+    return secrets.token_hex(6)
+
+def mask_ids(model):
+    ids = model.get("ids")
+    if isinstance(ids, list) and len(ids) == len(model["rects"]):
+        return ids
+    return list(range(len(model["rects"])))
+
+def card_position(model):
+    ids = mask_ids(model)
+    return ids.index(model["card"]) if model.get("card") in ids else None
+
+def card_models(model, set_id):
+    return [dict(model, set=set_id, card=mask_id) for mask_id in mask_ids(model)]
+
+def decode_model(value):
+    try:
+        model = json.loads(html.unescape(value))
+    except ValueError:
+        return None
+    if not isinstance(model, dict) or model.get("v") != MODEL_VERSION:
+        return None
+    return model
+
+def read_model(content):
+    match = DATA_PATTERN.search(content)
+    return decode_model(match.group(1)) if match else None
+
+def pixel_rects(model, width=None, height=None):
+    width = width or model["w"]
+    height = height or model["h"]
+    return [
+        (round(x * width), round(y * height), max(1, round(w * width)), max(1, round(h * height)))
+        for x, y, w, h in model["rects"]
+    ]
+
+def same_content(a, b):
+    keys = ("img", "rects", "texts", "card_option", "text_position", "mask_style")
+    return a is not None and b is not None and all(a.get(key) == b.get(key) for key in keys)
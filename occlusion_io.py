@@ -0,0 +1,127 @@
+import os
+import json
+import time
+from aqt import mw
+from aqt.qt import QAction, QFileDialog, QRect, qconnect
+from aqt.operations import CollectionOp, QueryOp
+from aqt.utils import showInfo
+from anki.errors import NotFoundError
+from .render import generate_html
+from .occlusion_data import card_position, pixel_rects, same_content
+from .note_images import find_note_images, replace_images
+
+SEARCH = '"data-oclusao"'
+WRITE_BATCH = 500
+
+def model_slots(note):
+    return [slot for slot in find_note_images(note) if slot.stored and "v" in slot.stored]
+
+def iter_records(col, nids):
+    for nid in nids:
+        note = col.get_note(nid)
+        for index, slot in enumerate(model_slots(note)):
+            yield {"nid": nid, "guid": note.guid, "field": slot.field, "index": index, "model": slot.stored}
+
+def export_models(col, path):
+    count = 0
+    with open(path, "w", encoding="utf-8") as f:
+        for record in iter_records(col, col.find_notes(SEARCH)):
+            f.write(json.dumps(record, ensure_ascii=False, separators=(",", ":")))
+            f.write("\n")
+            count += 1
+    return count
+
+def find_note(col, record):
+    try:
+        return col.get_note(record["nid"])
+    except (NotFoundError, KeyError):
+        nid = col.db.scalar("select id from notes where guid = ?", record.get("guid"))
+        return col.get_note(nid) if nid else None
+
+def target_slot(note, record):
+    slots = model_slots(note)
+    index = record.get("index")
+    if index is None:
+        slots = [slot for slot in slots if slot.field == record.get("field")]
+        index = 0
+    if index < len(slots):
+        return slots[index]
+    for slot in find_note_images(note):
+        if slot.stored is None and slot.field == record.get("field") and os.path.basename(slot.img_path) == record["model"]["img"]:
+            return slot
+    return None
+
+def render_model(model, media_dir):
+    rectangles = [QRect(*rect) for rect in pixel_rects(model)]
+    html_contents = generate_html(
+        model["img"], QRect(0, 0, model["w"], model["h"]), rectangles, media_dir, 1.0, str(int(time.time())),
+        model["card_option"], model["texts"], model["text_position"], model["mask_style"], model.get("set"), model.get("ids")
+    )
+    if model.get("card") is None:
+        return html_contents[0]
+    position = card_position(model)
+    if position is None:
+        raise ValueError(f"card {model['card']} fora do conjunto de {model['img']}")
+    return html_contents[position]
+
+def import_models(col, path, stats):
+    media_dir = col.media.dir()
+    undo_entry = col.add_custom_undo_entry("Importar oclusões")
+    pending = {}
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            note = find_note(col, record)
+            if note is not None:
+                note = pending.get(note.id, note)
+            slot = target_slot(note, record) if note is not None else None
+            if slot is None:
+                stats["missing"] += 1
+                continue
+            model = record["model"]
+            current = slot.stored
+            if same_content(current, model) and current.get("card") == model.get("card"):
+                stats["skipped"] += 1
+                continue
+            try:
+                html = render_model(model, media_dir)
+            except (FileNotFoundError, ValueError):
+                stats["missing"] += 1
+                continue
+            for field_name, value in replace_images(dict(note.items()), [(slot, html)]).items():
+                note[field_name] = value
+            pending[note.id] = note
+            stats["updated"] += 1
+            if len(pending) >= WRITE_BATCH:
+                col.update_notes(list(pending.values()))
+                pending = {}
+    if pending:
+        col.update_notes(list(pending.values()))
+    return col.merge_undo_entries(undo_entry)
+
+def export_action():
+    path, _ = QFileDialog.getSaveFileName(mw, "Exportar oclusões", "oclusoes.jsonl", "JSON Lines (*.jsonl)")
+    if not path:
+        return
+    QueryOp(
+        parent=mw,
+        op=lambda col: export_models(col, path),
+        success=lambda count: showInfo(f"{count} imagens exportadas para {path}")
+    ).with_progress("Exportando oclusões...").run_in_background()
+
+def import_action():
+    path, _ = QFileDialog.getOpenFileName(mw, "Importar oclusões", "", "JSON Lines (*.jsonl)")
+    if not path:
+        return
+    stats = {"updated": 0, "skipped": 0, "missing": 0}
+    CollectionOp(parent=mw, op=lambda col: import_models(col, path, stats)).success(
+        lambda changes: showInfo(f"{stats['updated']} imagens atualizadas, {stats['skipped']} sem mudanças, {stats['missing']} não encontradas.")
+    ).with_progress("Importando oclusões...").run_in_background()
+
+def setup_transfer_actions():
+    for label, func in (("Oclusão: exportar dados...", export_action), ("Oclusão: importar dados...", import_action)):
+        action = QAction(label, mw)
+        qconnect(action.triggered, func)
+        mw.form.menuTools.addAction(action)
@@ -0,0 +1,149 @@
+import os
+import json
+import threading
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+INDEX_PATH = os.path.join(os.path.dirname(__file__), "user_files", "phash_index.json")
+CHUNKS = 8
+CHUNK_BITS = 8
+CHUNK_MASK = (1 << CHUNK_BITS) - 1
+MAX_DISTANCE = CHUNKS - 1
+MAX_AHASH_DISTANCE = 14
+
+_lock = threading.Lock()
+_index = None
+
+def hamming(a, b):
+    return bin(a ^ b).count("1")
+
+def bits_to_int(bits):
+    value = 0
+    for bit in bits:
+        value = (value << 1) | int(bit)
+    return value
+
+def gray_pixels(image, width, height):
+    from aqt.qt import QImage, Qt
+    small = image.scaled(width, height, Qt.AspectRatioMode.IgnoreAspectRatio, Qt.TransformationMode.SmoothTransformation)
+    small = small.convertToFormat(QImage.Format.Format_Grayscale8)
+    ptr = small.constBits()
+    ptr.setsize(small.sizeInBytes())
+    data = bytes(ptr)
+    stride = small.bytesPerLine()
+    return [data[row * stride:row * stride + width] for row in range(height)]
+
+def block_sums(rows, columns, count):
+    block_w = len(rows[0]) // columns
+    block_h = len(rows) // count
+    return [
+        [sum(sum(row[x * block_w:(x + 1) * block_w]) for row in rows[y * block_h:(y + 1) * block_h]) for x in range(columns)]
+        for y in range(count)
+    ]
+
+def image_hashes(image):
+    drows = gray_pixels(image, 72, 64)
+    arows = gray_pixels(image, 64, 64)
+    if np is not None:
+        dgray = np.frombuffer(b"".join(drows), np.uint8).reshape(64, 72).astype(np.int64)
+        agray = np.frombuffer(b"".join(arows), np.uint8).reshape(64, 64).astype(np.int64)
+        dgrid = dgray.reshape(8, 8, 9, 8).sum(axis=(1, 3)).tolist()
+        agrid = agray.reshape(8, 8, 8, 8).sum(axis=(1, 3)).tolist()
+    else:
+        dgrid = block_sums(drows, 9, 8)
+        agrid = block_sums(arows, 8, 8)
+    dbits = [row[x + 1] > row[x] for row in dgrid for x in range(8)]
+    values = [v for row in agrid for v in row]
+    total = sum(values)
+    return bits_to_int(v * len(values) > total for v in values), bits_to_int(dbits)
+
+class MultiIndex:
+    def __init__(self):
+        self.tables = [{} for _ in range(CHUNKS)]
+        self.keys = {}
+
+    def chunks(self, key):
+        return [(key >> (CHUNK_BITS * i)) & CHUNK_MASK for i in range(CHUNKS)]
+
+    def add(self, key, item):
+        self.remove(item)
+        self.keys[item] = key
+        for table, chunk in zip(self.tables, self.chunks(key)):
+            table.setdefault(chunk, set()).add(item)
+
+    def remove(self, item):
+        key = self.keys.pop(item, None)
+        if key is None:
+            return
+        for table, chunk in zip(self.tables, self.chunks(key)):
+            bucket = table.get(chunk)
+            if bucket is not None:
+                bucket.discard(item)
+
+    def search(self, key, radius):
+        candidates = set()
+        for table, chunk in zip(self.tables, self.chunks(key)):
+            bucket = table.get(chunk)
+            if bucket:
+                candidates.update(bucket)
+        found = []
+        for item in candidates:
+            distance = hamming(key, self.keys[item])
+            if distance <= radius:
+                found.append((distance, item))
+        return found
+
+class TemplateIndex:
+    def __init__(self, path=INDEX_PATH):
+        self.path = path
+        self.entries = {}
+        self.tree = MultiIndex()
+        try:
+            with open(path, encoding="utf-8") as f:
+                self.entries = json.load(f)
+        except (OSError, ValueError):
+            self.entries = {}
+        for img, entry in self.entries.items():
+            self.tree.add(entry["dhash"], img)
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self.entries, f, ensure_ascii=False, separators=(",", ":"))
+        os.replace(tmp_path, self.path)
+
+    def add(self, img, hashes, model):
+        ahash, dhash = hashes
+        self.entries[img] = dict(model, ahash=ahash, dhash=dhash)
+        self.tree.add(dhash, img)
+        self.save()
+
+    def lookup(self, hashes, exclude=None):
+        ahash, dhash = hashes
+        matches = []
+        for distance, img in self.tree.search(dhash, MAX_DISTANCE):
+            entry = self.entries[img]
+            if img != exclude and entry["rects"] and hamming(entry["ahash"], ahash) <= MAX_AHASH_DISTANCE:
+                matches.append((distance, entry))
+        matches.sort(key=lambda match: match[0])
+        return matches
+
+def template_index():
+    global _index
+    if _index is None:
+        _index = TemplateIndex()
+    return _index
+
+def remember_layout(img, image, model):
+    hashes = image_hashes(image)
+    with _lock:
+        template_index().add(img, hashes, model)
+
+def similar_layouts(img, image):
+    hashes = image_hashes(image)
+    with _lock:
+        return template_index().lookup(hashes, exclude=img)
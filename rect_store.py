@@ -0,0 +1,136 @@
+from array import array
+
+GRID_CELL = 128
+
+class RectStore:
+    def __init__(self, cell_size=GRID_CELL):
+        self.cell_size = cell_size
+        self.xs = array('i')
+        self.ys = array('i')
+        self.ws = array('i')
+        self.hs = array('i')
+        self.texts = []
+        self.ids = []
+        self.next_id = 0
+        self.grid = {}
+
+    def __len__(self):
+        return len(self.xs)
+
+    def __iter__(self):
+        for i in range(len(self.xs)):
+            yield self.xs[i], self.ys[i], self.ws[i], self.hs[i]
+
+    def rect(self, index):
+        return self.xs[index], self.ys[index], self.ws[index], self.hs[index]
+
+    def cells(self, x, y, w, h):
+        size = self.cell_size
+        for cy in range(y // size, (y + max(h, 1) - 1) // size + 1):
+            for cx in range(x // size, (x + max(w, 1) - 1) // size + 1):
+                yield cx, cy
+
+    def index_rect(self, index):
+        for cell in self.cells(*self.rect(index)):
+            self.grid.setdefault(cell, set()).add(index)
+
+    def unindex_rect(self, index):
+        for cell in self.cells(*self.rect(index)):
+            bucket = self.grid.get(cell)
+            if bucket is not None:
+                bucket.discard(index)
+                if not bucket:
+                    del self.grid[cell]
+
+    def rebuild_index(self):
+        self.grid = {}
+        for index in range(len(self.xs)):
+            self.index_rect(index)
+
+    def claim_id(self, mask_id):
+        if mask_id is None:
+            mask_id = self.next_id
+        self.next_id = max(self.next_id, mask_id + 1)
+        return mask_id
+
+    def add(self, x, y, w, h, text="", mask_id=None):
+        self.xs.append(x)
+        self.ys.append(y)
+        self.ws.append(w)
+        self.hs.append(h)
+        self.texts.append(text)
+        self.ids.append(self.claim_id(mask_id))
+        index = len(self.xs) - 1
+        self.index_rect(index)
+        return index
+
+    def insert(self, index, x, y, w, h, text="", mask_id=None):
+        if index >= len(self.xs):
+            return self.add(x, y, w, h, text, mask_id)
+        self.xs.insert(index, x)
+        self.ys.insert(index, y)
+        self.ws.insert(index, w)
+        self.hs.insert(index, h)
+        self.texts.insert(index, text)
+        self.ids.insert(index, self.claim_id(mask_id))
+        self.rebuild_index()
+        return index
+
+    def set_rect(self, index, x, y, w, h):
+        self.unindex_rect(index)
+        self.xs[index] = x
+        self.ys[index] = y
+        self.ws[index] = w
+        self.hs[index] = h
+        self.index_rect(index)
+
+    def move(self, index, dx, dy):
+        x, y, w, h = self.rect(index)
+        self.set_rect(index, x + dx, y + dy, w, h)
+
+    def remove(self, indices):
+        doomed = set(indices)
+        if not doomed:
+            return
+        last = len(self.xs) - 1
+        if doomed == {last}:
+            self.unindex_rect(last)
+            for column in (self.xs, self.ys, self.ws, self.hs, self.texts, self.ids):
+                column.pop()
+            return
+        keep = [i for i in range(len(self.xs)) if i not in doomed]
+        self.xs = array('i', (self.xs[i] for i in keep))
+        self.ys = array('i', (self.ys[i] for i in keep))
+        self.ws = array('i', (self.ws[i] for i in keep))
+        self.hs = array('i', (self.hs[i] for i in keep))
+        self.texts = [self.texts[i] for i in keep]
+        self.ids = [self.ids[i] for i in keep]
+        self.rebuild_index()
+
+    def clear(self):
+        self.__init__(self.cell_size)
+
+    def hit(self, x, y):
+        bucket = self.grid.get((x // self.cell_size, y // self.cell_size))
+        if not bucket:
+            return None
+        best = None
+        for index in bucket:
+            rx, ry, rw, rh = self.xs[index], self.ys[index], self.ws[index], self.hs[index]
+            if rx <= x < rx + rw and ry <= y < ry + rh and (best is None or index > best):
+                best = index
+        return best
+
+    def query(self, x, y, w, h):
+        found = set()
+        grid = self.grid
+        for cell in self.cells(x, y, w, h):
+            bucket = grid.get(cell)
+            if bucket:
+                found.update(bucket)
+        right, bottom = x + w, y + h
+        return sorted(
+            index for index in found
+            if self.xs[index] < right and self.xs[index] + self.ws[index] > x
+            and self.ys[index] < bottom and self.ys[index] + self.hs[index] > y
+        )
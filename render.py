@@ -0,0 +1,109 @@
+import os
+import html
+from .assets import ASSET_TAGS
+from .occlusion_data import as_box, as_size, build_model, data_attribute, card_models, new_set_id
+from .tracing import traced
+
+def svg_masks(img_filename, masks, width, height):
+    rects_svg = "".join(
+        f'<rect class="anki-mask" id="rect{i}" data-correct-text="{html.escape(text, quote=True)}" x="{x}" y="{y}" width="{w}" height="{h}"/>'
+        for i, (x, y, w, h), text in masks
+    )
+    return f"""<div class="anki-image-container">
+        <img src="{img_filename}">
+        <svg class="anki-mask-layer" viewBox="0 0 {width} {height}" preserveAspectRatio="none">{rects_svg}</svg>
+    </div>"""
+
+@traced("render.generate_html")
+def generate_html(img_path, size, rectangles, output_dir, scale_factor, timestamp, card_option="single", texts=None, text_position="top", mask_style="div", set_id=None, ids=None):
+    img_filename = os.path.basename(img_path)
+    full_path = os.path.join(output_dir, img_filename)
+    if not os.path.exists(full_path):
+        raise FileNotFoundError(f"Image file not found: {full_path}")
+    orig_width, orig_height = as_size(size)
+    boxes = [as_box(rect) for rect in rectangles]
+    texts = texts or []
+    model = build_model(img_filename, orig_width, orig_height, boxes, texts, card_option, text_position, mask_style, ids)
+    
+    container_style = "position:relative;"
+    text_container_style = ""
+    if text_position == "top":
+        container_style += "display:flex; flex-direction:column; align-items:center;"
+        text_container_style = "display:flex; flex-wrap:wrap; gap:10px; margin-bottom:10px;"
+    elif text_position == "bottom":
+        container_style += "display:flex; flex-direction:column; align-items:center;"
+        text_container_style = "display:flex; flex-wrap:wrap; gap:10px; margin-top:10px;"
+    elif text_position == "left":
+        container_style += "display:flex; flex-direction:row; align-items:flex-start;"
+        text_container_style = "display:flex; flex-direction:column; gap:10px; margin-right:10px;"
+    elif text_position == "right":
+        container_style += "display:flex; flex-direction:row; align-items:flex-start;"
+        text_container_style = "display:flex; flex-direction:column; gap:10px; margin-left:10px;"
+    
+    
+    if card_option == "single":
+        if mask_style == "svg":
+            masks = [(i, box, texts[i] if i < len(texts) else '') for i, box in enumerate(boxes)]
+            image_html = svg_masks(img_filename, masks, orig_width, orig_height)
+        else:
+            rects_html = ""
+            for i, (x, y, w, h) in enumerate(boxes):
+                left_percent = (x / orig_width) * 100
+                top_percent = (y / orig_height) * 100
+                width_percent = (w / orig_width) * 100
+                height_percent = (h / orig_height) * 100
+                rects_html += f"""
+            <div class="anki-rect" id="rect{i}" data-correct-text="{html.escape(texts[i] if i < len(texts) else '', quote=True)}"
+                 style="left:{left_percent}%;top:{top_percent}%;width:{width_percent}%;height:{height_percent}%;z-index:10;"
+                 draggable="false">
+            </div>"""
+            image_html = f"""<div class="anki-image-container">
+        <img src="{img_filename}" style="z-index:1;">
+        {rects_html}
+    </div>"""
+        
+        return [f"""
+<div class="anki-container" {data_attribute(model)} style="{container_style}">
+    <div class="anki-text-container" style="{text_container_style}"></div>
+    {image_html}
+    <div class="anki-controls">
+        <button id="showButton_{timestamp}">👁️‍🗨️ Mostrar</button>
+        <button id="hideButton_{timestamp}">👁️ Ocultar</button>
+    </div>
+</div>
+{ASSET_TAGS}
+"""]
+    else:
+        cards_html = []
+        attributes = [data_attribute(card_model) for card_model in card_models(model, set_id or new_set_id())]
+        for i, box in enumerate(boxes):
+            x, y, w, h = box
+            left_percent = (x / orig_width) * 100
+            top_percent = (y / orig_height) * 100
+            width_percent = (w / orig_width) * 100
+            height_percent = (h / orig_height) * 100
+            
+            if mask_style == "svg":
+                image_html = svg_masks(img_filename, [(i, box, texts[i] if i < len(texts) else '')], orig_width, orig_height)
+            else:
+                image_html = f"""<div style="position:relative; display:inline-block; max-width:100%;">
+        <img src="{img_filename}" style="max-width:100%; width:100%; z-index:1;">
+        <div class="anki-rect-multi" id="rect{i}" data-correct-text="{html.escape(texts[i] if i < len(texts) else '', quote=True)}"
+             style="position:absolute; left:{left_percent}%; top:{top_percent}%; 
+                    width:{width_percent}%; height:{height_percent}%; z-index:10;"
+             draggable="false">
+        </div>
+    </div>"""
+            
+            cards_html.append(f"""
+<div class="anki-multiple-card" id="card{i}" {attributes[i]} style="{container_style}">
+    <div class="anki-text-container" style="{text_container_style}"></div>
+    {image_html}
+    <div style="margin-top:10px;">
+        <button id="showBtn{i}_{timestamp}">👁️‍🗨️ Mostrar</button>
+        <button id="hideBtn{i}_{timestamp}">👁️ Ocultar</button>
+    </div>
+</div>
+{ASSET_TAGS}
+""")
+        return cards_html
@@ -0,0 +1,202 @@
+import os
+import json
+import math
+import time
+import threading
+import functools
+
+TRACE_DIR = os.path.join(os.path.dirname(__file__), "user_files", "traces")
+SETTINGS_PATH = os.path.join(os.path.dirname(__file__), "user_files", "tracing.json")
+TRACE_FILENAME = "trace.json"
+MAX_TRACE_BYTES = 4 * 1024 * 1024
+TRACE_FILES = 3
+FLUSH_EVERY = 200
+JS_MESSAGE_PREFIX = "oclusao-trace:"
+
+_lock = threading.Lock()
+_file_lock = threading.Lock()
+_events = []
+_enabled = False
+
+def load_settings():
+    try:
+        with open(SETTINGS_PATH, encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def enabled():
+    return _enabled
+
+def set_enabled(value):
+    global _enabled
+    if _enabled and not value:
+        flush()
+    _enabled = bool(value)
+    os.makedirs(os.path.dirname(SETTINGS_PATH), exist_ok=True)
+    with open(SETTINGS_PATH, "w", encoding="utf-8") as f:
+        json.dump({"enabled": _enabled}, f)
+
+def now_us():
+    return time.perf_counter_ns() // 1000
+
+def record(name, start_us, dur_us, cat="python", tid=None, args=None):
+    event = {
+        "name": name, "cat": cat, "ph": "X", "ts": start_us, "dur": dur_us,
+        "pid": os.getpid(), "tid": threading.get_ident() if tid is None else tid,
+    }
+    if args:
+        event["args"] = args
+    with _lock:
+        _events.append(event)
+        pending = len(_events)
+    if pending >= FLUSH_EVERY:
+        flush()
+
+class NullSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+NULL_SPAN = NullSpan()
+
+class Span:
+    def __init__(self, name, args):
+        self.name = name
+        self.args = args
+        self.start = 0
+
+    def __enter__(self):
+        self.start = now_us()
+        return self
+
+    def __exit__(self, *exc):
+        record(self.name, self.start, now_us() - self.start, args=self.args)
+        return False
+
+def span(name, **args):
+    if not _enabled:
+        return NULL_SPAN
+    return Span(name, args)
+
+def traced(name):
+    def decorate(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return func(*args, **kwargs)
+            with Span(name, None):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorate
+
+def record_js(message):
+    if not _enabled:
+        return
+    try:
+        payload = json.loads(message[len(JS_MESSAGE_PREFIX):])
+        dur_us = int(float(payload["dur"]) * 1000)
+        name = str(payload["name"])
+    except (ValueError, KeyError, TypeError):
+        return
+    record(name, now_us() - dur_us, dur_us, cat="reviewer", tid=0)
+
+def trace_path(index=0, trace_dir=TRACE_DIR):
+    if index == 0:
+        return os.path.join(trace_dir, TRACE_FILENAME)
+    return os.path.join(trace_dir, f"trace.{index}.json")
+
+def rotate(trace_dir=TRACE_DIR):
+    for index in range(TRACE_FILES - 1, 0, -1):
+        source = trace_path(index - 1, trace_dir)
+        if os.path.exists(source):
+            os.replace(source, trace_path(index, trace_dir))
+
+def flush(trace_dir=TRACE_DIR):
+    with _file_lock:
+        with _lock:
+            events = _events[:]
+            del _events[:]
+        if not events:
+            return
+        os.makedirs(trace_dir, exist_ok=True)
+        path = trace_path(0, trace_dir)
+        try:
+            if os.path.getsize(path) > MAX_TRACE_BYTES:
+                rotate(trace_dir)
+        except OSError:
+            pass
+        new_file = not os.path.exists(path)
+        with open(path, "a", encoding="utf-8") as f:
+            if new_file:
+                f.write("[\n")
+            for event in events:
+                f.write(json.dumps(event, separators=(",", ":")))
+                f.write(",\n")
+
+def load_events(trace_dir=TRACE_DIR):
+    events = []
+    for index in range(TRACE_FILES - 1, -1, -1):
+        try:
+            with _file_lock, open(trace_path(index, trace_dir), encoding="utf-8") as f:
+                text = f.read().rstrip().rstrip(",")
+        except OSError:
+            continue
+        try:
+            events.extend(json.loads(text + "]"))
+        except ValueError:
+            continue
+    return events
+
+def percentile(sorted_values, fraction):
+    index = max(0, min(len(sorted_values) - 1, math.ceil(fraction * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+def summarize(events):
+    durations = {}
+    for event in events:
+        if event.get("ph") == "X":
+            durations.setdefault(event["name"], []).append(event["dur"] / 1000)
+    summary = []
+    for name, values in durations.items():
+        values.sort()
+        summary.append((name, len(values), percentile(values, 0.5), percentile(values, 0.95)))
+    summary.sort(key=lambda row: -row[3])
+    return summary
+
+def summary_text():
+    flush()
+    rows = summarize(load_events())
+    if not rows:
+        return "Nenhum tempo registrado ainda."
+    width = max(len(name) for name, _, _, _ in rows)
+    lines = [f"{'etapa':<{width}}  {'n':>6}  {'p50 ms':>10}  {'p95 ms':>10}"]
+    for name, count, p50, p95 in rows:
+        lines.append(f"{name:<{width}}  {count:>6}  {p50:>10.2f}  {p95:>10.2f}")
+    lines.append("")
+    lines.append(f"Arquivo de trace (chrome://tracing): {trace_path()}")
+    return "\n".join(lines)
+
+def handle_js_message(handled, message, context):
+    if isinstance(message, str) and message.startswith(JS_MESSAGE_PREFIX):
+        record_js(message)
+        return (True, None)
+    return handled
+
+def setup_trace_actions(mw):
+    from aqt.qt import QAction, qconnect
+    from aqt.utils import showText
+
+    toggle = QAction("Oclusão: registrar tempos", mw)
+    toggle.setCheckable(True)
+    toggle.setChecked(_enabled)
+    qconnect(toggle.toggled, set_enabled)
+    mw.form.menuTools.addAction(toggle)
+
+    summary = QAction("Oclusão: resumo de tempos (p50/p95)...", mw)
+    qconnect(summary.triggered, lambda: showText(summary_text(), title="Tempos da oclusão", plain_text_edit=True))
+    mw.form.menuTools.addAction(summary)
+
+_enabled = bool(os.environ.get("OCLUSAO_TRACE")) or bool(load_settings().get("enabled"))